@@ -1,6 +1,16 @@
-from django_filters.rest_framework import CharFilter, FilterSet, BooleanFilter
+from django_filters.rest_framework import (
+    BaseInFilter,
+    BooleanFilter,
+    CharFilter,
+    ChoiceFilter,
+    FilterSet,
+    NumberFilter,
+)
 from ingredients.models import IngredientModel
 from recipes.models import Dish
+from recipes.index import RecipeIngredientIndex
+from recipes.ranking import ORDERINGS, RecipeRanking
+from recipes.search import RecipeSearch
 
 
 class ComponentFilter(FilterSet):
@@ -11,22 +21,61 @@ class ComponentFilter(FilterSet):
         fields = ("name",)
 
 
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
+
+
 class DishFilter(FilterSet):
+    search = CharFilter(method="filter_search")
+    ingredients = NumberInFilter(method="filter_ingredients")
+    match = ChoiceFilter(
+        choices=RecipeIngredientIndex.MATCH_CHOICES, method="filter_match"
+    )
+    ordering = ChoiceFilter(
+        choices=[(name, name) for name in ORDERINGS], method="filter_ordering"
+    )
     is_favorited = BooleanFilter(method="filter_favorited")
     is_in_shopping_cart = BooleanFilter(method="filter_in_shopping_cart")
 
     class Meta:
         model = Dish
-        fields = ("author", "is_favorited", "is_in_shopping_cart")
+        fields = (
+            "author",
+            "is_favorited",
+            "is_in_shopping_cart",
+            "search",
+            "ingredients",
+            "match",
+            "ordering",
+        )
+
+    def filter_search(self, queryset, name, value):
+        return RecipeSearch.filter(queryset, value)
+
+    def filter_ingredients(self, queryset, name, value):
+        if not value:
+            return queryset
+        recipe_ids = RecipeIngredientIndex.match(
+            {int(pk) for pk in value},
+            self.form.cleaned_data.get("match") or RecipeIngredientIndex.ALL,
+        )
+        return queryset.filter(pk__in=recipe_ids)
+
+    def filter_match(self, queryset, name, value):
+        # Only tells filter_ingredients how to combine the ids.
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        return RecipeRanking.order(queryset, value)
 
     def filter_favorited(self, queryset, name, value):
-        return self.filter_by_user(queryset, "favorites", value)
+        return self.filter_by_user(queryset, "is_favorited", value)
 
     def filter_in_shopping_cart(self, queryset, name, value):
-        return self.filter_by_user(queryset, "shopping_cart", value)
+        return self.filter_by_user(queryset, "is_in_shopping_cart", value)
 
     def filter_by_user(self, queryset, field, value):
         user = self.request.user
         if value and not user.is_anonymous:
-            return queryset.filter(**{f"{field}__user": user})
+            return queryset.filter(**{field: True})
         return queryset
@@ -0,0 +1,68 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    # Bounded by both the thread count and the number of queued jobs, so a
+    # burst of jobs is rejected instead of piling up in a gunicorn worker.
+
+    workers = 1
+    thread_name_prefix = "worker"
+    _executor = None
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(1)
+
+    @classmethod
+    def executor(cls):
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=cls.workers,
+                    thread_name_prefix=cls.thread_name_prefix,
+                )
+            return cls._executor
+
+    @classmethod
+    def submit(cls, task, *args):
+        if not cls._slots.acquire(blocking=False):
+            return False
+        cls.executor().submit(cls._run, task, *args)
+        return True
+
+    @classmethod
+    def _run(cls, task, *args):
+        try:
+            task(*args)
+        except Exception:
+            logger.exception(
+                "Задача %s %r завершилась с ошибкой", task.__qualname__, args
+            )
+        finally:
+            close_old_connections()
+            cls._slots.release()
+
+
+class ExportWorkerPool(WorkerPool):
+    workers = settings.EXPORT_WORKERS
+    thread_name_prefix = "export"
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(settings.EXPORT_QUEUE_SIZE)
+
+
+class ImageWorkerPool(WorkerPool):
+    workers = settings.IMAGE_WORKERS
+    thread_name_prefix = "image"
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(settings.IMAGE_QUEUE_SIZE)
+
+
+class FeedWorkerPool(WorkerPool):
+    workers = settings.FEED_WORKERS
+    thread_name_prefix = "feed"
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(settings.FEED_QUEUE_SIZE)
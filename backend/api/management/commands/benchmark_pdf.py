@@ -0,0 +1,80 @@
+import os
+import timeit
+from io import BytesIO
+
+import fpdf
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from fpdf import FPDF
+
+from api.pdf import CachedFontPDF
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время генерации PDF списка покупок до и после кэша шрифтов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--recipes", nargs="+", type=int, default=[1, 50, 500]
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        fonts = os.path.join(settings.STATIC_ROOT, "fonts")
+        self.regular = os.path.join(fonts, "DejaVuSans.ttf")
+        self.bold = os.path.join(fonts, "DejaVuSans-Bold.ttf")
+        # The legacy path must not leave .pkl metric caches next to the fonts.
+        fpdf.set_global("FPDF_CACHE_MODE", 1)
+        self.render_cached(1)
+        self.stdout.write(
+            f"{'recipes':>8} {'before, ms':>12} {'after, ms':>12}"
+        )
+        for count in options["recipes"]:
+            before = self.measure(self.render_legacy, count, options["repeat"])
+            after = self.measure(self.render_cached, count, options["repeat"])
+            self.stdout.write(f"{count:>8} {before:>12.1f} {after:>12.1f}")
+
+    @staticmethod
+    def measure(render, count, repeat):
+        return (
+            min(timeit.repeat(lambda: render(count), number=1, repeat=repeat))
+            * 1000
+        )
+
+    def fill(self, pdf, count):
+        pdf.add_page()
+        pdf.set_font("CoreFont", "B", 16)
+        pdf.cell(0, 10, "Grocery List", ln=True, align="C")
+        for index in range(count):
+            pdf.set_font("CoreFont", "B", 14)
+            pdf.cell(0, 10, f"Recipe: Блюдо №{index}", ln=True)
+            pdf.set_font("CoreFont", "", 12)
+            pdf.cell(0, 8, "Author: Иван Петров (ivan)", ln=True)
+            pdf.multi_cell(
+                0, 8, "Description: Смешать, запечь и подать — горячим."
+            )
+            for number in range(8):
+                pdf.cell(
+                    0,
+                    8,
+                    f"- Ингредиент {number} — {index + number} г",
+                    ln=True,
+                )
+
+    def render_legacy(self, count):
+        pdf = FPDF()
+        pdf.add_font("CoreFont", "", self.regular, uni=True)
+        pdf.add_font("CoreFont", "B", self.bold, uni=True)
+        self.fill(pdf, count)
+        return BytesIO(pdf.output(dest="S").encode("latin-1", errors="ignore"))
+
+    def render_cached(self, count):
+        pdf = CachedFontPDF()
+        pdf.add_cached_font("CoreFont", "", self.regular)
+        pdf.add_cached_font("CoreFont", "B", self.bold)
+        self.fill(pdf, count)
+        output = BytesIO()
+        pdf.write_to(output)
+        return output
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.services import ExportJobRunner
+
+
+class Command(BaseCommand):
+    help = "Завершает зависшие выгрузки и удаляет устаревшие вместе с файлами"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        failed, deleted = ExportJobRunner.expire()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Прервано выгрузок: {failed}, удалено: {deleted} "
+                f"за {time.perf_counter() - started:.2f} с"
+            )
+        )
@@ -0,0 +1,57 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from api.services import ImageJobRunner
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает фото рецептов, которые ждут в очереди"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Работать постоянно, как воркер",
+        )
+        parser.add_argument("--interval", type=float, default=5)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            try:
+                total = self.drain()
+            except DatabaseError:
+                if not options["loop"]:
+                    raise
+                # The worker outlives a lost database and tries again later.
+                logger.exception("Очередь фото недоступна")
+                total = 0
+            elapsed = time.perf_counter() - started
+            if total or not options["loop"]:
+                self.stdout.write(
+                    self.style.SUCCESS(f"Фото: {total} за {elapsed:.2f} с")
+                )
+            if not options["loop"]:
+                return
+            close_old_connections()
+            time.sleep(options["interval"])
+
+    @staticmethod
+    def drain():
+        total = 0
+        jobs = ImageJobRunner.claimable().values_list("pk", flat=True)
+        for job_id in list(jobs):
+            try:
+                ImageJobRunner.run(job_id)
+            except Exception:
+                # The job stays claimed and is retried after IMAGE_JOB_TIMEOUT.
+                logger.exception("Фото задачи %s не обработано", job_id)
+                close_old_connections()
+                continue
+            total += 1
+        return total
@@ -0,0 +1,263 @@
+import os
+import re
+import threading
+import zlib
+
+from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
+
+from core.cache import LRUCache
+
+# Basic Latin, Latin-1, Cyrillic and typographic punctuation are always
+# embedded, so the subset (and everything derived from it) is the same for
+# almost every shopping list and can be reused between documents.
+PRELOADED_GLYPHS = (
+    *range(0x20, 0x7F),
+    *range(0xA0, 0x100),
+    *range(0x400, 0x460),
+    *range(0x2010, 0x2027),
+    0x2116,
+    0x20BD,
+)
+SUBSET_CACHE_SIZE = 32
+DESCRIPTOR_KEYS = (
+    "Ascent",
+    "Descent",
+    "CapHeight",
+    "Flags",
+    "FontBBox",
+    "ItalicAngle",
+    "StemV",
+    "MissingWidth",
+)
+TO_UNICODE = (
+    "/CIDInit /ProcSet findresource begin\n"
+    "12 dict begin\n"
+    "begincmap\n"
+    "/CIDSystemInfo\n"
+    "<</Registry (Adobe)\n"
+    "/Ordering (UCS)\n"
+    "/Supplement 0\n"
+    ">> def\n"
+    "/CMapName /Adobe-Identity-UCS def\n"
+    "/CMapType 2 def\n"
+    "1 begincodespacerange\n"
+    "<0000> <FFFF>\n"
+    "endcodespacerange\n"
+    "1 beginbfrange\n"
+    "<0000> <FFFF> <0000>\n"
+    "endbfrange\n"
+    "endcmap\n"
+    "CMapName currentdict /CMap defineresource pop\n"
+    "end\n"
+    "end"
+)
+
+
+class FontRegistry:
+    _fonts = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path):
+        with cls._lock:
+            if path not in cls._fonts:
+                cls._fonts[path] = cls._load(path)
+            return cls._fonts[path]
+
+    @staticmethod
+    def _load(path):
+        ttf = TTFontFile()
+        ttf.getMetrics(path)
+        return {
+            "name": re.sub("[ ()]", "", ttf.fullName),
+            "desc": {
+                "Ascent": int(round(ttf.ascent, 0)),
+                "Descent": int(round(ttf.descent, 0)),
+                "CapHeight": int(round(ttf.capHeight, 0)),
+                "Flags": ttf.flags,
+                "FontBBox": "[%s %s %s %s]"
+                % tuple(int(round(value, 0)) for value in ttf.bbox),
+                "ItalicAngle": int(ttf.italicAngle),
+                "StemV": int(round(ttf.stemV, 0)),
+                "MissingWidth": int(round(ttf.defaultWidth, 0)),
+            },
+            "up": round(ttf.underlinePosition),
+            "ut": round(ttf.underlineThickness),
+            "cw": ttf.charWidths,
+            "originalsize": os.stat(path).st_size,
+        }
+
+
+class GlyphSubset(list):
+    """FPDF appends every rendered character; keep each glyph only once."""
+
+    def __init__(self, glyphs=()):
+        super().__init__()
+        self._seen = set()
+        for glyph in glyphs:
+            self.append(glyph)
+
+    def append(self, glyph):
+        if glyph not in self._seen:
+            self._seen.add(glyph)
+            super().append(glyph)
+
+    def __contains__(self, glyph):
+        return glyph in self._seen
+
+    def __delitem__(self, index):
+        self._seen.discard(self[index])
+        super().__delitem__(index)
+
+
+class CachedFontPDF(FPDF):
+    subsets = LRUCache(SUBSET_CACHE_SIZE)
+    widths = LRUCache(SUBSET_CACHE_SIZE)
+
+    def add_cached_font(self, family, style, path):
+        fontkey = family.lower() + style.upper()
+        if fontkey in self.fonts:
+            return
+        font = FontRegistry.get(path)
+        base = 57 if hasattr(self, "str_alias_nb_pages") else 32
+        self.fonts[fontkey] = {
+            "i": len(self.fonts) + 1,
+            "type": "TTF",
+            "name": font["name"],
+            "desc": font["desc"],
+            "up": font["up"],
+            "ut": font["ut"],
+            "cw": font["cw"],
+            "ttffile": path,
+            "fontkey": fontkey,
+            "subset": GlyphSubset((*range(base), *PRELOADED_GLYPHS)),
+            "unifilename": None,
+        }
+        self.font_files[fontkey] = {
+            "length1": font["originalsize"],
+            "type": "TTF",
+            "ttffile": path,
+        }
+        self.font_files[path] = {"type": "TTF"}
+
+    @classmethod
+    def embedded(cls, path, subset):
+        # The compressed subset and CIDToGIDMap of a glyph set, as FPDF would
+        # build them for every document.
+        key = (path, tuple(sorted(subset)))
+        cached = cls.subsets.get(key)
+        if cached is None:
+            ttf = TTFontFile()
+            stream = ttf.makeSubset(path, subset)
+            cidtogidmap = bytearray(256 * 256 * 2)
+            for code, glyph in ttf.codeToGlyph.items():
+                cidtogidmap[code * 2] = glyph >> 8
+                cidtogidmap[code * 2 + 1] = glyph & 0xFF
+            cached = {
+                "size": len(stream),
+                "stream": zlib.compress(stream),
+                "cidtogidmap": zlib.compress(bytes(cidtogidmap)),
+                "maxUni": ttf.maxUni,
+            }
+            cls.subsets.set(key, cached)
+        return cached
+
+    def _putfonts(self):
+        # Fonts other than add_cached_font ones go through FPDF unchanged.
+        if self.diffs or any(
+            font["type"] != "TTF" for font in self.fonts.values()
+        ):
+            return super()._putfonts()
+        for _, fontkey, font in sorted(
+            (font["i"], fontkey, font) for fontkey, font in self.fonts.items()
+        ):
+            self._put_cached_font(fontkey, font)
+
+    def _put_cached_font(self, fontkey, font):
+        # Writes the same objects as the TTF branch of FPDF._putfonts.
+        self.fonts[fontkey]["n"] = self.n + 1
+        fontname = f"MPDFAA+{font['name']}"
+        subset = font["subset"]
+        del subset[0]
+        embedded = self.embedded(font["ttffile"], subset)
+        self._newobj()
+        self._out("<</Type /Font")
+        self._out("/Subtype /Type0")
+        self._out(f"/BaseFont /{fontname}")
+        self._out("/Encoding /Identity-H")
+        self._out(f"/DescendantFonts [{self.n + 1} 0 R]")
+        self._out(f"/ToUnicode {self.n + 2} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out("<</Type /Font")
+        self._out("/Subtype /CIDFontType2")
+        self._out(f"/BaseFont /{fontname}")
+        self._out(f"/CIDSystemInfo {self.n + 2} 0 R")
+        self._out(f"/FontDescriptor {self.n + 3} 0 R")
+        if font["desc"].get("MissingWidth"):
+            self._out("/DW %d" % font["desc"]["MissingWidth"])
+        self._putTTfontwidths(font, embedded["maxUni"])
+        self._out(f"/CIDToGIDMap {self.n + 4} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out(f"<</Length {len(TO_UNICODE)}>>")
+        self._putstream(TO_UNICODE)
+        self._out("endobj")
+
+        self._newobj()
+        self._out("<</Registry (Adobe)")
+        self._out("/Ordering (UCS)")
+        self._out("/Supplement 0")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out("<</Type /FontDescriptor")
+        self._out(f"/FontName /{fontname}")
+        for name in DESCRIPTOR_KEYS:
+            value = font["desc"][name]
+            if name == "Flags":
+                # Non-symbolic, as FPDF declares it.
+                value = (value | 4) & ~32
+            self._out(f" /{name} {value}")
+        self._out(f"/FontFile2 {self.n + 2} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out(f"<</Length {len(embedded['cidtogidmap'])}")
+        self._out("/Filter /FlateDecode")
+        self._out(">>")
+        self._putstream(embedded["cidtogidmap"])
+        self._out("endobj")
+
+        self._newobj()
+        self._out(f"<</Length {len(embedded['stream'])}")
+        self._out("/Filter /FlateDecode")
+        self._out(f"/Length1 {embedded['size']}")
+        self._out(">>")
+        self._putstream(embedded["stream"])
+        self._out("endobj")
+
+    def _putTTfontwidths(self, font, maxUni):
+        key = (font["ttffile"], maxUni, frozenset(font["subset"]))
+        widths = self.widths.get(key)
+        if widths is None:
+            start = len(self.buffer)
+            super()._putTTfontwidths(font, maxUni)
+            self.widths.set(key, self.buffer[start:])
+        else:
+            self.buffer += widths
+
+    def write_to(self, stream, chunk_size=64 * 1024):
+        if self.state < 3:
+            self.close()
+        for start in range(0, len(self.buffer), chunk_size):
+            end = start + chunk_size
+            chunk = self.buffer[start:end]
+            stream.write(chunk.encode("latin-1", errors="ignore"))
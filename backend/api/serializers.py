@@ -1,7 +1,19 @@
 from rest_framework.validators import UniqueTogetherValidator
 from django.db import transaction
+from django.urls import reverse
 from ingredients.models import IngredientModel
-from recipes.models import Dish, ComponentRecipe, FavoriteDish, ShoppingCart, ShortUrl
+from recipes.models import (
+    Dish,
+    ComponentRecipe,
+    ExportJob,
+    FavoriteDish,
+    ShoppingCart,
+    ShortUrl,
+)
+from api.services import ImageJobRunner
+from core.images import Base64Image
+from recipes.index import RecipeIngredientIndex
+from recipes.similarity import RecipeSimilarityIndex
 from users.models import SubscriptionPlan, BlogerUser
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
@@ -17,16 +29,69 @@ MAX_COOKING_TIME = 32_000
 User = get_user_model()
 
 
+class ImageVariantField(serializers.Field):
+    # URL of a resized copy from <image_field>_variants, the original file is
+    # returned for images uploaded before the variants existed.
+    def __init__(self, image_field, variant, **kwargs):
+        self.image_field = image_field
+        self.variant = variant
+        kwargs.update(source="*", read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        field_file = getattr(instance, self.image_field)
+        if not field_file:
+            return None
+        variants = (
+            getattr(instance, f"{self.image_field}_variants", None) or {}
+        )
+        name = variants.get(self.variant)
+        url = field_file.storage.url(name) if name else field_file.url
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+
+class StreamingImageField(Base64ImageField):
+    # Decodes into a spooled temporary file instead of one bytes object.
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        return Base64Image.from_string(data)
+
+
+class DeferredImageField(StreamingImageField):
+    # Only the first chunk is decoded to reject non-images early, the full
+    # payload is decoded and validated by ImageJobRunner after the commit.
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        Base64Image.probe(data)
+        return data
+
+
 class ProfileImageSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(allow_null=True, required=False)
+    avatar = StreamingImageField(allow_null=True, required=False)
 
     class Meta:
         model = User
         fields = ("avatar",)
 
+    def update(self, profile, validated_data):
+        # request.user is loaded before the request changes anything, a full
+        # save would write its stale recipe and follower counters back.
+        for attr, value in validated_data.items():
+            setattr(profile, attr, value)
+        profile.save(update_fields=validated_data.keys())
+        return profile
+
 
 class EnhancedUserSerializer(ProfileImageSerializer, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_thumb = ImageVariantField("avatar", "thumb")
 
     class Meta:
         model = User
@@ -38,10 +103,13 @@ class EnhancedUserSerializer(ProfileImageSerializer, serializers.ModelSerializer
             "last_name",
             "is_subscribed",
             "avatar",
+            "avatar_thumb",
         )
         read_only_fields = ("id", "is_subscribed")
 
     def get_is_subscribed(self, profile):
+        if hasattr(profile, "is_subscribed"):
+            return profile.is_subscribed
         try:
             current_user = self.context["request"].user
             if current_user.is_anonymous:
@@ -57,6 +125,15 @@ class ComponentSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit")
 
 
+class RecipeComponentListSerializer(serializers.ListSerializer):
+    def get_attribute(self, dish):
+        # Rows just written by create or update are served without a query.
+        components = getattr(dish, "stored_components", None)
+        if components is not None:
+            return components
+        return super().get_attribute(dish)
+
+
 class RecipeComponentSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(source="ingredient.id")
     name = serializers.CharField(source="ingredient.name", read_only=True)
@@ -75,10 +152,13 @@ class RecipeComponentSerializer(serializers.ModelSerializer):
     class Meta:
         model = ComponentRecipe
         fields = ("id", "name", "measurement_unit", "amount")
+        list_serializer_class = RecipeComponentListSerializer
 
 
 class DishSerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
+    image = DeferredImageField()
+    image_thumb = ImageVariantField("image", "thumb")
+    image_webp = ImageVariantField("image", "webp")
     ingredients = RecipeComponentSerializer(many=True, source="ingredient_recipes")
     author = EnhancedUserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField()
@@ -102,10 +182,17 @@ class DishSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_thumb",
+            "image_webp",
+            "image_status",
             "text",
             "cooking_time",
         )
-        read_only_fields = ("is_favorited", "is_in_shopping_cart")
+        read_only_fields = (
+            "is_favorited",
+            "is_in_shopping_cart",
+            "image_status",
+        )
 
     def validate_image(self, image):
         if not image:
@@ -124,8 +211,10 @@ class DishSerializer(serializers.ModelSerializer):
         ingredient_ids = [ing["ingredient"]["id"] for ing in ingredients]
         if len(ingredient_ids) != len(set(ingredient_ids)):
             raise serializers.ValidationError("Ingredients must be unique.")
-        existing_ids = set(IngredientModel.objects.values_list("id", flat=True))
-        missing_ids = set(ingredient_ids) - existing_ids
+        self.ingredient_objects = IngredientModel.objects.in_bulk(
+            ingredient_ids
+        )
+        missing_ids = set(ingredient_ids) - self.ingredient_objects.keys()
         if missing_ids:
             raise serializers.ValidationError(
                 f"Ingredients with IDs {', '.join(map(str, missing_ids))} not found."
@@ -142,37 +231,66 @@ class DishSerializer(serializers.ModelSerializer):
             return False
 
     def get_is_favorited(self, dish):
+        if hasattr(dish, "is_favorited"):
+            return dish.is_favorited
         return self._check_relation(dish, "favorites")
 
     def get_is_in_shopping_cart(self, dish):
+        if hasattr(dish, "is_in_shopping_cart"):
+            return dish.is_in_shopping_cart
         return self._check_relation(dish, "shopping_cart")
 
     def _store_ingredients(self, dish, ingredient_data):
-        ComponentRecipe.objects.bulk_create(
+        dish.stored_components = ComponentRecipe.objects.bulk_create(
             [
                 ComponentRecipe(
                     recipe=dish,
-                    ingredient_id=item["ingredient"]["id"],
+                    ingredient=self.ingredient_objects[
+                        item["ingredient"]["id"]
+                    ],
                     amount=item["amount"],
                 )
                 for item in ingredient_data
             ]
         )
+        # bulk_create sends no post_save, so the inverted index is told here.
+        ingredient_ids = [
+            item.ingredient_id for item in dish.stored_components
+        ]
+        transaction.on_commit(
+            lambda: RecipeIngredientIndex.replace(dish.pk, ingredient_ids)
+        )
+        transaction.on_commit(RecipeSimilarityIndex.mark_stale)
 
     @transaction.atomic
     def create(self, validated_data):
         ingredient_data = validated_data.pop("ingredient_recipes", None)
+        image = validated_data.pop("image")
+        author = self.context["request"].user
         dish = Dish.objects.create(
-            author=self.context["request"].user, **validated_data
+            author=author,
+            image_status=Dish.ImageStatus.PENDING,
+            **validated_data,
         )
+        ImageJobRunner.enqueue(dish, image)
         self._store_ingredients(dish, ingredient_data)
+        dish.is_favorited = dish.is_in_shopping_cart = False
         return dish
 
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredient_data = validated_data.pop("ingredient_recipes", None)
+        image = validated_data.pop("image", None)
+        if image:
+            # The current photo is served until the new one is processed.
+            validated_data["image_status"] = Dish.ImageStatus.PENDING
+            ImageJobRunner.enqueue(instance, image)
         instance.ingredients.clear()
-        instance = super().update(instance, validated_data)
+        # Only the fields of the request are written: the image fields belong
+        # to the image worker and favorites_count to concurrent F() updates.
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=(*validated_data, "updated_at"))
         self._store_ingredients(instance, ingredient_data)
         return instance
 
@@ -183,10 +301,54 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit")
 
 
+class CartTotalSerializer(ComponentSerializer):
+    amount = serializers.IntegerField(read_only=True)
+
+    class Meta(ComponentSerializer.Meta):
+        fields = ("id", "name", "measurement_unit", "amount")
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    format = serializers.ChoiceField(
+        source="export_format",
+        choices=ExportJob.Format.choices,
+        default=ExportJob.Format.PDF,
+    )
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = (
+            "id",
+            "format",
+            "status",
+            "error",
+            "created_at",
+            "finished_at",
+            "download_url",
+        )
+        read_only_fields = (
+            "id",
+            "status",
+            "error",
+            "created_at",
+            "finished_at",
+        )
+
+    def get_download_url(self, job):
+        if job.status != ExportJob.Status.DONE:
+            return None
+        return self.context["request"].build_absolute_uri(
+            reverse("api:shopping-cart-exports-download", args=(job.pk,))
+        )
+
+
 class CompactDishSerializer(serializers.ModelSerializer):
+    image_thumb = ImageVariantField("image", "thumb")
+
     class Meta:
         model = Dish
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_thumb", "cooking_time")
 
 
 class BaseCartFavoriteSerializer(serializers.ModelSerializer):
@@ -226,7 +388,7 @@ class FavoriteDishSerializer(BaseCartFavoriteSerializer):
 
 class FollowSerializer(EnhancedUserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(EnhancedUserSerializer.Meta):
         fields = (
@@ -239,20 +401,26 @@ class FollowSerializer(EnhancedUserSerializer):
             "recipes",
             "recipes_count",
             "avatar",
+            "avatar_thumb",
         )
 
+    @staticmethod
+    def get_recipes_limit(request):
+        try:
+            limit = int(request.query_params["recipes_limit"])
+        except (KeyError, ValueError):
+            return None
+        return max(limit, 0)
+
     def get_recipes(self, obj):
-        recipes = obj.recipes.all()
         request = self.context.get("request")
-        limit = int(request.query_params.get("recipes_limit", len(recipes)))
-        recipes = recipes[:limit]
+        recipes = getattr(obj, "recipes_preview", None)
+        if recipes is None:
+            recipes = obj.recipes.all()[: self.get_recipes_limit(request)]
         return CompactDishSerializer(
             recipes, many=True, context={"request": request}
         ).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.all().count()
-
 
 class SubscriptionHandlerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -272,4 +440,10 @@ class SubscriptionHandlerSerializer(serializers.ModelSerializer):
         return author
 
     def to_representation(self, instance):
-        return FollowSerializer(instance.author, context=self.context).data
+        request = self.context["request"]
+        author = (
+            User.objects.with_is_subscribed(request.user)
+            .with_recipes(FollowSerializer.get_recipes_limit(request))
+            .get(pk=instance.author_id)
+        )
+        return FollowSerializer(author, context=self.context).data
@@ -1,29 +1,149 @@
+import csv
+import hashlib
 import os as sys_os
-from io import BytesIO as StreamIO
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
 from django.conf import settings as config
-from fpdf import FPDF as DocumentPDF
+from django.core.cache import caches
+from django.core.files.base import ContentFile, File
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework import status as api_status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404 as fetch_obj
 from rest_framework.response import Response as WebResponse
-from recipes.models import Dish as DishModel, ShoppingCart as UserBasket
-from api.serializers import DishSerializer as DishDataSerializer
+from api.jobs import ImageWorkerPool
+from api.pdf import CachedFontPDF as DocumentPDF
+from core.images import Base64Image, ImageVariants
+from ingredients.index import IngredientIndex
+from ingredients.models import IngredientModel
+from recipes.models import (
+    Dish as DishModel,
+    ExportJob,
+    ImageJob,
+    ShoppingCart as UserBasket,
+)
+from recipes.ranking import RecipeRanking
+
+PDF_MEMORY_LIMIT = 1024 * 1024
 
 
 class CartProcessor:
     @staticmethod
     def fetch_user_cart(user):
-        return [item.recipe for item in UserBasket.objects.filter(user=user)]
+        return (
+            DishModel.objects.filter(shopping_cart__user=user)
+            .select_related("author")
+            .prefetch_related("ingredient_recipes__ingredient")
+        )
+
+    @staticmethod
+    def fetch_cart_totals(user):
+        return (
+            IngredientModel.objects.filter(
+                ingredient_recipes__recipe__shopping_cart__user=user
+            )
+            .annotate(amount=Sum("ingredient_recipes__amount"))
+            .order_by("name")
+        )
+
+
+class CatalogManager:
+    @staticmethod
+    def respond(request):
+        body, compressed, digest = IngredientIndex.catalog()
+        use_gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        etag = f'"{digest}-gzip"' if use_gzip else f'"{digest}"'
+        if_none_match = {
+            tag.removeprefix("W/")
+            for tag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+        }
+        if etag in if_none_match or "*" in if_none_match:
+            response = HttpResponse(status=api_status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(
+                compressed if use_gzip else body,
+                content_type="application/json",
+            )
+            if use_gzip:
+                response["Content-Encoding"] = "gzip"
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+class ExportCache:
+    @staticmethod
+    def backend():
+        return caches[config.SHOPPING_LIST_CACHE]
+
+    @staticmethod
+    def make_key(user, export_format):
+        # Identical carts render identical files, so the key is a digest of
+        # the cart content rather than of the user. Author names are printed
+        # in the PDF and are not covered by the recipe's updated_at.
+        digest = hashlib.sha256(export_format.encode())
+        items = (
+            UserBasket.objects.filter(user=user)
+            .order_by("recipe_id")
+            .values_list(
+                "recipe_id",
+                "recipe__updated_at",
+                "recipe__author__username",
+                "recipe__author__first_name",
+                "recipe__author__last_name",
+            )
+        )
+        for recipe_id, updated_at, *author in items:
+            digest.update(f"{recipe_id}:{updated_at.isoformat()}".encode())
+            for name in author:
+                digest.update(f":{len(name)}:{name}".encode())
+            digest.update(b";")
+        return f"shopping_list:{digest.hexdigest()}"
+
+    @staticmethod
+    def get(key):
+        return ExportCache.backend().get(key)
+
+    @staticmethod
+    def set(key, content):
+        if len(content) <= config.SHOPPING_LIST_CACHE_MAX_ITEM_SIZE:
+            ExportCache.backend().set(key, content)
+
+    @staticmethod
+    def store_file(key, file):
+        file.seek(0, sys_os.SEEK_END)
+        if file.tell() <= config.SHOPPING_LIST_CACHE_MAX_ITEM_SIZE:
+            file.seek(0)
+            ExportCache.set(key, file.read())
+        file.seek(0)
+        return file
 
     @staticmethod
-    def handle_dishes(request):
-        dishes = CartProcessor.fetch_user_cart(request.user)
-        serializer = DishDataSerializer(dishes, many=True, context={"request": request})
-        return serializer.data
+    def store_chunks(key, chunks):
+        parts, size = [], 0
+        for chunk in chunks:
+            chunk = chunk.encode() if isinstance(chunk, str) else chunk
+            if parts is not None:
+                size += len(chunk)
+                if size <= config.SHOPPING_LIST_CACHE_MAX_ITEM_SIZE:
+                    parts.append(chunk)
+                else:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            ExportCache.set(key, b"".join(parts))
 
 
 class DocumentGenerator:
-    def __init__(self, dish_data):
-        self.dishes = dish_data
+    def __init__(self, dishes, totals):
+        self.dishes = dishes
+        self.totals = totals
         self.pdf = DocumentPDF()
         self._initialize_pdf()
 
@@ -31,71 +151,160 @@ class DocumentGenerator:
         self.pdf.add_page()
         font_path = sys_os.path.join(config.STATIC_ROOT, "fonts", "DejaVuSans.ttf")
         bold_path = sys_os.path.join(config.STATIC_ROOT, "fonts", "DejaVuSans-Bold.ttf")
-        self.pdf.add_font("CoreFont", "", font_path, uni=True)
-        self.pdf.add_font("CoreFont", "B", bold_path, uni=True)
+        self.pdf.add_cached_font("CoreFont", "", font_path)
+        self.pdf.add_cached_font("CoreFont", "B", bold_path)
         self.pdf.set_font("CoreFont", size=12)
 
     def create(self):
         self._add_heading("Grocery List", 16, "B", "C")
         self.pdf.ln(10)
-        ingredient_list = []
 
         for dish in self.dishes:
-            self._handle_dish(dish, ingredient_list)
+            self._handle_dish(dish)
             self.pdf.ln(10)
 
-        self._generate_ingredient_summary(ingredient_list)
-        pdf_output = self.pdf.output(dest="S").encode("latin-1", errors="ignore")
-        return StreamIO(pdf_output)
+        self._generate_ingredient_summary(self.totals)
+        output = SpooledTemporaryFile(max_size=PDF_MEMORY_LIMIT)
+        self.pdf.write_to(output)
+        output.seek(0)
+        return output
 
     def _add_heading(self, text, size=12, style="", align="L"):
         self.pdf.set_font("CoreFont", style, size)
         self.pdf.cell(0, 10, text, ln=True, align=align)
         self.pdf.set_font("CoreFont", "", 12)
 
-    def _handle_dish(self, dish_data, ingredient_list):
-        self._add_heading(f"Recipe: {dish_data['name']}", 14, "B")
-        creator = dish_data["author"]
+    def _handle_dish(self, dish):
+        self._add_heading(f"Recipe: {dish.name}", 14, "B")
+        creator = dish.author
         self._add_line(
-            f"Author: {creator['first_name']} {creator['last_name']} ({creator['username']})"
+            f"Author: {creator.first_name} {creator.last_name} "
+            f"({creator.username})"
         )
-        self._add_line(f"Cooking time: {dish_data['cooking_time']} min")
-        self.pdf.multi_cell(0, 8, f"Description: {dish_data['text']}")
+        self._add_line(f"Cooking time: {dish.cooking_time} min")
+        self.pdf.multi_cell(0, 8, f"Description: {dish.text}")
         self.pdf.ln(5)
         self._add_heading("Ingredients:", 12, "B")
 
-        for ingredient in dish_data["ingredients"]:
-            formatted = self._format_ingredient(ingredient)
-            self._add_line(formatted)
-            ingredient_list.append(ingredient)
+        for item in dish.ingredient_recipes.all():
+            self._add_line(
+                self._format_ingredient(item.ingredient, item.amount)
+            )
 
     def _add_line(self, text):
         self.pdf.cell(0, 8, text, ln=True)
 
-    def _format_ingredient(self, ingredient):
-        return f"- {ingredient['name']} — {ingredient['amount']} {ingredient['measurement_unit']}"
+    def _format_ingredient(self, ingredient, amount):
+        return f"- {ingredient.name} — {amount} {ingredient.measurement_unit}"
 
-    def _generate_ingredient_summary(self, ingredients):
+    def _generate_ingredient_summary(self, totals):
         self.pdf.ln(10)
         self._add_heading("Full grocery list:", 14, "B")
-        unique_ingredients = {}
 
-        for item in ingredients:
-            key = (item["name"], item["measurement_unit"])
-            if key not in unique_ingredients:
-                unique_ingredients[key] = item
+        for ingredient in totals:
+            self._add_line(
+                self._format_ingredient(ingredient, ingredient.amount)
+            )
+
+
+class EchoBuffer:
+    def write(self, value):
+        return value
+
+
+class TextExporter:
+    content_type = "text/plain; charset=utf-8"
+
+    def __init__(self, totals):
+        self.totals = totals
+
+    def __iter__(self):
+        yield "Full grocery list:\n"
+        for ingredient in self.totals.iterator():
+            yield (
+                f"- {ingredient.name} — {ingredient.amount} "
+                f"{ingredient.measurement_unit}\n"
+            )
 
-        for item in unique_ingredients.values():
-            self._add_line(self._format_ingredient(item))
+
+class CSVExporter(TextExporter):
+    content_type = "text/csv; charset=utf-8"
+
+    def __iter__(self):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(("name", "measurement_unit", "amount"))
+        for ingredient in self.totals.iterator():
+            yield writer.writerow(
+                (
+                    ingredient.name,
+                    ingredient.measurement_unit,
+                    ingredient.amount,
+                )
+            )
 
 
 class DishManager:
+    EXPORTERS = {"txt": TextExporter, "csv": CSVExporter}
+    CONTENT_TYPES = {
+        "pdf": "application/pdf",
+        "txt": TextExporter.content_type,
+        "csv": CSVExporter.content_type,
+    }
+
     @staticmethod
-    def generate_pdf(request):
-        dishes = CartProcessor.handle_dishes(request)
-        pdf_generator = DocumentGenerator(dishes)
+    def generate_pdf(user):
+        pdf_generator = DocumentGenerator(
+            CartProcessor.fetch_user_cart(user),
+            CartProcessor.fetch_cart_totals(user),
+        )
         return pdf_generator.create()
 
+    @staticmethod
+    def render_export(user, export_format):
+        key = ExportCache.make_key(user, export_format)
+        content = ExportCache.get(key)
+        if content is not None:
+            return ContentFile(content)
+        if export_format == "pdf":
+            output = DishManager.generate_pdf(user)
+        else:
+            output = SpooledTemporaryFile(max_size=PDF_MEMORY_LIMIT)
+            exporter = DishManager.EXPORTERS[export_format](
+                CartProcessor.fetch_cart_totals(user)
+            )
+            for chunk in exporter:
+                output.write(chunk.encode())
+        return ExportCache.store_file(key, output)
+
+    @staticmethod
+    def export_cart(request, export_format="pdf"):
+        if export_format not in DishManager.CONTENT_TYPES:
+            export_format = "pdf"
+        key = ExportCache.make_key(request.user, export_format)
+        content = ExportCache.get(key)
+        if content is not None:
+            response = HttpResponse(
+                content, content_type=DishManager.CONTENT_TYPES[export_format]
+            )
+        elif export_format == "pdf":
+            response = FileResponse(
+                ExportCache.store_file(
+                    key, DishManager.generate_pdf(request.user)
+                ),
+                content_type=DishManager.CONTENT_TYPES[export_format],
+            )
+        else:
+            exporter = DishManager.EXPORTERS[export_format](
+                CartProcessor.fetch_cart_totals(request.user)
+            )
+            response = StreamingHttpResponse(
+                ExportCache.store_chunks(key, exporter),
+                content_type=exporter.content_type,
+            )
+        filename = f"{config.NAME_SHOPPING_CART_LIST_FILE}.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
     @staticmethod
     def verify_relation(user, obj, relation, field="recipe"):
         if not user or not hasattr(user, relation) or user.is_anonymous:
@@ -104,20 +313,150 @@ class DishManager:
         return manager.filter(**{field: obj}).exists()
 
     @staticmethod
+    @transaction.atomic
     def add_link(request, dish_id, serializer_class):
-        fetch_obj(DishModel, pk=dish_id)
+        dish = fetch_obj(DishModel, pk=dish_id)
         serializer = serializer_class(
             data={"recipe": dish_id, "user": request.user.id},
             context={"request": request},
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        transaction.on_commit(lambda: RecipeRanking.record(dish.pk))
         return WebResponse(serializer.data, status=api_status.HTTP_201_CREATED)
 
     @staticmethod
+    @transaction.atomic
     def remove_link(request, dish_id, model_class):
         dish = fetch_obj(DishModel, pk=dish_id)
         deleted, _ = model_class.objects.filter(recipe=dish, user=request.user).delete()
         if not deleted:
             return WebResponse(status=api_status.HTTP_400_BAD_REQUEST)
+        transaction.on_commit(lambda: RecipeRanking.record(dish.pk))
         return WebResponse(status=api_status.HTTP_204_NO_CONTENT)
+
+
+class ExportJobRunner:
+    UNFINISHED = (ExportJob.Status.PENDING, ExportJob.Status.RUNNING)
+
+    @staticmethod
+    def run(job_id):
+        claimed = ExportJob.objects.filter(
+            pk=job_id, status=ExportJob.Status.PENDING
+        ).update(status=ExportJob.Status.RUNNING)
+        if not claimed:
+            return
+        try:
+            job = ExportJob.objects.select_related("user").get(pk=job_id)
+            output = DishManager.render_export(job.user, job.export_format)
+            filename = (
+                f"{config.NAME_SHOPPING_CART_LIST_FILE}.{job.export_format}"
+            )
+            job.file.save(filename, File(output), save=False)
+            job.status = ExportJob.Status.DONE
+            job.finished_at = timezone.now()
+            job.save(update_fields=("file", "status", "finished_at"))
+        except Exception as error:
+            ExportJob.objects.filter(pk=job_id).update(
+                status=ExportJob.Status.FAILED,
+                error=str(error) or error.__class__.__name__,
+                finished_at=timezone.now(),
+            )
+            raise
+
+    @staticmethod
+    def expire(jobs=None):
+        # Jobs lost with a restarted worker never finish, so they are failed
+        # after EXPORT_JOB_TIMEOUT; files and rows are kept for EXPORT_JOB_TTL.
+        jobs = ExportJob.objects.all() if jobs is None else jobs
+        now = timezone.now()
+        failed = jobs.filter(
+            status__in=ExportJobRunner.UNFINISHED,
+            created_at__lt=now - timedelta(seconds=config.EXPORT_JOB_TIMEOUT),
+        ).update(
+            status=ExportJob.Status.FAILED,
+            error="Выгрузка прервана, попробуйте ещё раз",
+            finished_at=now,
+        )
+        deleted, _ = jobs.filter(
+            created_at__lt=now - timedelta(seconds=config.EXPORT_JOB_TTL)
+        ).delete()
+        return failed, deleted
+
+
+class ImageJobRunner:
+    # The request only stores the base64 payload; decoding, validation and
+    # the variants run here, in an ImageWorkerPool thread or in
+    # `manage.py process_images` for jobs the pool rejected or lost.
+
+    @staticmethod
+    def enqueue(dish, data):
+        job = ImageJob(recipe=dish)
+        with SpooledTemporaryFile(
+            max_size=config.IMAGE_UPLOAD_SPOOL_SIZE
+        ) as payload:
+            for chunk in Base64Image.chunks(data, Base64Image.offset(data)):
+                payload.write(chunk.encode("ascii", errors="replace"))
+            job.payload.save(f"{job.pk}.b64", File(payload), save=False)
+        job.save()
+        transaction.on_commit(
+            lambda: ImageWorkerPool.submit(ImageJobRunner.run, job.pk)
+        )
+        return job
+
+    @staticmethod
+    def claimable():
+        stale = timezone.now() - timedelta(seconds=config.IMAGE_JOB_TIMEOUT)
+        return ImageJob.objects.filter(
+            Q(started_at__isnull=True) | Q(started_at__lt=stale)
+        )
+
+    @classmethod
+    def run(cls, job_id):
+        claimed = (
+            cls.claimable().filter(pk=job_id).update(started_at=timezone.now())
+        )
+        if not claimed:
+            return
+        # Deleting the recipe since the claim takes its jobs along.
+        job = ImageJob.objects.filter(pk=job_id).first()
+        if job is None:
+            return
+        field = DishModel._meta.get_field("image")
+        names = None
+        try:
+            with job.payload.open("rb") as payload:
+                image = Base64Image.decode(payload.chunks())
+            with image:
+                names = ImageVariants.build(
+                    field.storage, field.upload_to, image
+                )
+        except (ValidationError, *ImageVariants.ERRORS):
+            # Anything the decoder or Pillow rejects marks the photo failed.
+            pass
+        with transaction.atomic():
+            dish = DishModel.objects.select_for_update().filter(
+                pk=job.recipe_id
+            )
+            dish = dish.first()
+            jobs = ImageJob.objects.filter(recipe=job.recipe_id)
+            # Only the latest upload of a recipe may replace its photo; once
+            # it has, the older jobs still running find themselves deleted.
+            current = (
+                dish is not None
+                and jobs.filter(pk=job.pk).exists()
+                and not jobs.filter(created_at__gt=job.created_at).exists()
+            )
+            if current:
+                if names is None:
+                    dish.image_status = DishModel.ImageStatus.FAILED
+                else:
+                    dish.image = names["original"]
+                    dish.image_variants = names
+                    dish.image_status = DishModel.ImageStatus.READY
+                dish.save(
+                    update_fields=("image", "image_variants", "image_status")
+                )
+                jobs.filter(created_at__lte=job.created_at).delete()
+            else:
+                jobs.filter(pk=job.pk).delete()
@@ -0,0 +1,131 @@
+import atexit
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.cache import LRUCache
+from recipes.models import Dish, ShortLinkStat, ShortUrl
+from recipes.utils import decode_short_code
+
+# Unknown tokens are cached too, so scanning random codes does not reach the DB
+MISSING = ""
+
+
+class ShortLinkResolver:
+    local = LRUCache(settings.SHORT_LINK_CACHE_SIZE)
+
+    @staticmethod
+    def shared():
+        if not settings.SHORT_LINK_CACHE:
+            return None
+        return caches[settings.SHORT_LINK_CACHE]
+
+    @classmethod
+    def resolve(cls, token):
+        target = cls.local.get(token)
+        if target is not None:
+            return target or None
+        shared = cls.shared()
+        key = f"short-link:{token}"
+        if shared is not None:
+            target = shared.get(key)
+        if target is None:
+            target = cls.lookup(token)
+            if shared is not None:
+                shared.set(key, target, cls.timeout(target))
+        # forget() only reaches this process; the other workers see a deleted
+        # or new recipe once their local entry expires.
+        cls.local.set(token, target, cls.timeout(target))
+        return target or None
+
+    @staticmethod
+    def timeout(target):
+        if target:
+            return settings.SHORT_LINK_CACHE_TIMEOUT
+        return settings.SHORT_LINK_MISS_TIMEOUT
+
+    @staticmethod
+    def lookup(token):
+        recipe_id = decode_short_code(token)
+        if recipe_id is not None:
+            if Dish.objects.filter(pk=recipe_id).exists():
+                return f"/recipes/{recipe_id}/"
+            return MISSING
+        # Links issued before short codes were derived from recipe ids.
+        origin = (
+            ShortUrl.objects.filter(short_url=f"/s/{token}/")
+            .values_list("origin_url", flat=True)
+            .first()
+        )
+        return origin or MISSING
+
+    @classmethod
+    def forget(cls, token):
+        cls.local.delete(token)
+        shared = cls.shared()
+        if shared is not None:
+            shared.delete(f"short-link:{token}")
+
+
+class HitCounter:
+    # Redirects only bump an in-memory counter; the totals are written in one
+    # transaction once enough hits piled up or the interval has passed.
+
+    _pending = Counter()
+    _last_hit = {}
+    _lock = threading.Lock()
+    _flushed_at = time.monotonic()
+
+    @classmethod
+    def record(cls, token):
+        with cls._lock:
+            cls._pending[token] += 1
+            cls._last_hit[token] = timezone.now()
+            due = (
+                sum(cls._pending.values())
+                >= settings.SHORT_LINK_FLUSH_THRESHOLD
+                or time.monotonic() - cls._flushed_at
+                >= settings.SHORT_LINK_FLUSH_INTERVAL
+            )
+        if due:
+            try:
+                cls.flush()
+            except DatabaseError:
+                # The hits are queued again; a redirect must not fail on stats
+                pass
+
+    @classmethod
+    def flush(cls):
+        with cls._lock:
+            pending, cls._pending = cls._pending, Counter()
+            last_hit, cls._last_hit = cls._last_hit, {}
+            cls._flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            with transaction.atomic():
+                ShortLinkStat.objects.bulk_create(
+                    [ShortLinkStat(token=token) for token in pending],
+                    ignore_conflicts=True,
+                )
+                for token, hits in pending.items():
+                    ShortLinkStat.objects.filter(token=token).update(
+                        hits=F("hits") + hits,
+                        last_hit_at=last_hit[token],
+                    )
+        except DatabaseError:
+            # Put the hits back so a failed flush is retried with the next one
+            with cls._lock:
+                cls._pending.update(pending)
+                for token, moment in last_hit.items():
+                    cls._last_hit.setdefault(token, moment)
+            raise
+
+
+atexit.register(HitCounter.flush)
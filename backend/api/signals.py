@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Dish
+from recipes.utils import encode_recipe_id
+from .shortlinks import ShortLinkResolver
+
+
+@receiver(post_save, sender=Dish)
+def forget_missing_short_link(sender, instance, created, raw, **kwargs):
+    # The code of a new recipe may have been cached as missing.
+    if created and not raw:
+        token = encode_recipe_id(instance.pk)
+        transaction.on_commit(lambda: ShortLinkResolver.forget(token))
+
+
+@receiver(post_delete, sender=Dish)
+def forget_short_link(sender, instance, **kwargs):
+    token = encode_recipe_id(instance.pk)
+    transaction.on_commit(lambda: ShortLinkResolver.forget(token))
@@ -0,0 +1,435 @@
+import base64
+import random
+import textwrap
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from api.jobs import ImageWorkerPool
+from api.services import ImageJobRunner
+from api.shortlinks import HitCounter, ShortLinkResolver
+from core.cache import LRUCache
+from core.images import UPLOAD_CHUNK_SIZE, Base64Image
+from core.testing import BackgroundJobsMixin, create_user
+from ingredients.models import IngredientModel
+from recipes.models import (
+    ComponentRecipe,
+    Dish,
+    FavoriteDish,
+    FeedEntry,
+    ShoppingCart,
+    ShortUrl,
+)
+from users.models import BlogerUser, SubscriptionPlan
+
+
+class RecipeListQueriesTest(TestCase):
+    # A page of recipes must cost the same number of queries whatever its
+    # size: authors, ingredients and the per-user flags are loaded per page.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user("reader")
+        authors = [create_user(f"cook{number}") for number in range(3)]
+        ingredients = IngredientModel.objects.bulk_create(
+            IngredientModel(name=f"Ингредиент {number}", measurement_unit="г")
+            for number in range(5)
+        )
+        for number in range(12):
+            recipe = Dish.objects.create(
+                author=authors[number % len(authors)],
+                name=f"Рецепт {number}",
+                text="Описание",
+                cooking_time=10,
+                image="recipes/images/recipe.jpg",
+            )
+            ComponentRecipe.objects.bulk_create(
+                ComponentRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in ingredients[: number % 4 + 1]
+            )
+            if number % 2:
+                FavoriteDish.objects.create(user=cls.reader, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.reader, recipe=recipe)
+        SubscriptionPlan.objects.create(user=cls.reader, author=authors[0])
+
+    def count_queries(self, client, url):
+        # The first request fills the cached count of the list.
+        client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def assertPagesCostTheSame(self, client, query=""):
+        url = f"/api/recipes/?{query}limit="
+        expected, small = self.count_queries(client, f"{url}2")
+        self.assertEqual(len(small["results"]), 2)
+        client.get(f"{url}10")
+        with self.assertNumQueries(expected):
+            response = client.get(f"{url}10")
+        self.assertEqual(len(response.json()["results"]), 10)
+        return response.json()["results"]
+
+    def test_anonymous(self):
+        results = self.assertPagesCostTheSame(APIClient())
+        self.assertFalse(any(recipe["is_favorited"] for recipe in results))
+        self.assertFalse(results[0]["author"]["is_subscribed"])
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        results = self.assertPagesCostTheSame(client)
+        favorited = {
+            recipe["id"] for recipe in results if recipe["is_favorited"]
+        }
+        self.assertEqual(
+            favorited,
+            set(
+                FavoriteDish.objects.filter(
+                    user=self.reader,
+                    recipe__in=[recipe["id"] for recipe in results],
+                ).values_list("recipe_id", flat=True)
+            ),
+        )
+        self.assertTrue(
+            all(
+                recipe["author"]["is_subscribed"]
+                == (recipe["author"]["username"] == "cook0")
+                for recipe in results
+            )
+        )
+
+    def test_cursor_pages(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        self.assertPagesCostTheSame(client, "cursor=&")
+
+
+class CursorPaginationTest(TestCase):
+    # Next and previous links walk the keyset without repeating or skipping
+    # recipes, also across rows published at the same moment.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, *cls.authors = map(create_user, ("reader", "a", "b"))
+        for number in range(9):
+            Dish.objects.create(
+                author=cls.authors[number % 2],
+                name=f"Рецепт {number}",
+                text="Описание",
+                cooking_time=10,
+                image="recipes/images/recipe.jpg",
+            )
+        moment = timezone.now()
+        for number, pk in enumerate(
+            Dish.objects.order_by("pk").values_list("pk", flat=True)
+        ):
+            Dish.objects.filter(pk=pk).update(
+                created_at=moment + timedelta(seconds=number // 3)
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertNotIn("count", data)
+            pages.append([recipe["id"] for recipe in data["results"]])
+            url = data[link]
+        return pages
+
+    def assertPagesWalk(self, url, expected):
+        pages = self.walk(url, "next")
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [4, 4, 1])
+        last = self.client.get(url)
+        for _ in pages[1:]:
+            last = self.client.get(last.json()["next"])
+        backwards = self.walk(last.json()["previous"], "previous")
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_recipe_list(self):
+        self.assertPagesWalk(
+            "/api/recipes/?cursor=&limit=4",
+            list(
+                Dish.objects.order_by("-created_at", "-id").values_list(
+                    "pk", flat=True
+                )
+            ),
+        )
+
+    def test_feed(self):
+        # The first author's recipes are pushed into the feed, the second
+        # one is read on demand; the pages merge both streams.
+        pushed, pulled = self.authors
+        BlogerUser.objects.filter(pk=pulled.pk).update(feed_pulled=True)
+        for author in self.authors:
+            SubscriptionPlan.objects.create(user=self.reader, author=author)
+        Dish.objects.create(
+            author=create_user("stranger"),
+            name="Чужой рецепт",
+            text="Описание",
+            cooking_time=10,
+            image="recipes/images/recipe.jpg",
+        )
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(), 5)
+        self.assertPagesWalk(
+            "/api/recipes/feed/?limit=4",
+            list(
+                Dish.objects.filter(author__in=self.authors)
+                .order_by("-created_at", "-id")
+                .values_list("pk", flat=True)
+            ),
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/recipes/?cursor=bm9wZQ")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/api/recipes/?cursor=&ordering=popular")
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipePhotoTest(BackgroundJobsMixin, TestCase):
+    # A recipe is listed for others once its photo has been processed.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader = map(create_user, ("author", "reader"))
+        cls.ingredient = IngredientModel.objects.create(
+            name="Свёкла", measurement_unit="г"
+        )
+
+    def setUp(self):
+        self.use_temporary_media()
+        self.run_jobs_inline(ImageWorkerPool)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    @staticmethod
+    def photo(truncated=False):
+        noise = random.Random(0).randbytes(64 * 64 * 3)
+        output = BytesIO()
+        Image.frombytes("RGB", (64, 64), noise).save(output, "PNG")
+        content = output.getvalue()
+        if truncated:
+            content = content[: len(content) // 2]
+        return f"data:image/png;base64,{base64.b64encode(content).decode()}"
+
+    def send(self, method, url, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(url, data, format="json")
+
+    def create(self, image):
+        return self.send(
+            "post",
+            "/api/recipes/",
+            name="Борщ",
+            text="Свёкла, капуста",
+            cooking_time=30,
+            image=image,
+            ingredients=[{"id": self.ingredient.pk, "amount": 100}],
+        )
+
+    def listed(self, user):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return [
+            recipe["id"]
+            for recipe in client.get("/api/recipes/").json()["results"]
+        ]
+
+    def test_processed_photo(self):
+        response = self.create(self.photo())
+        self.assertEqual(response.status_code, 201)
+        recipe = Dish.objects.get(pk=response.json()["id"])
+        self.assertEqual(recipe.image_status, Dish.ImageStatus.READY)
+        self.assertEqual(recipe.image.name, recipe.image_variants["original"])
+        self.assertEqual(self.listed(None), [recipe.pk])
+
+    def test_failed_first_photo(self):
+        response = self.create(self.photo(truncated=True))
+        self.assertEqual(response.status_code, 201)
+        recipe_id = response.json()["id"]
+        url = f"/api/recipes/{recipe_id}/"
+        self.assertEqual(self.listed(None), [])
+        self.assertEqual(self.listed(self.reader), [])
+        self.assertEqual(self.listed(self.author), [recipe_id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()["image_status"], "failed")
+        self.assertIsNone(response.json()["image"])
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_authenticate(self.author)
+        response = self.send(
+            "patch",
+            url,
+            image=self.photo(),
+            ingredients=[{"id": self.ingredient.pk, "amount": 100}],
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url).json()["image_status"], "ready")
+        self.assertEqual(self.listed(self.reader), [recipe_id])
+
+
+class Base64ImageTest(TestCase):
+    @staticmethod
+    def encode(size=(64, 64), image_format="PNG"):
+        noise = random.Random(0).randbytes(size[0] * size[1] * 3)
+        output = BytesIO()
+        Image.frombytes("RGB", size, noise).save(output, image_format)
+        return output.getvalue(), base64.b64encode(output.getvalue()).decode()
+
+    def assertRejected(self, message, method, data):
+        with self.assertRaises(ValidationError) as error:
+            method(data)
+        self.assertEqual(error.exception.detail, [message])
+
+    def test_decodes_in_chunks(self):
+        # Line breaks and chunk borders fall in the middle of base64 quads.
+        content, data = self.encode((256, 256))
+        wrapped = "\n".join(textwrap.wrap(data, 77))
+        self.assertGreater(len(wrapped), 3 * UPLOAD_CHUNK_SIZE)
+        upload = Base64Image.from_string(f"data:image/png;base64,{wrapped}")
+        self.assertEqual(upload.read(), content)
+        self.assertEqual(upload.size, len(content))
+        self.assertEqual(upload.content_type, "image/png")
+        self.assertTrue(upload.name.endswith(".png"))
+        self.assertEqual(Base64Image.probe(data), 0)
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=4096)
+    def test_too_large(self):
+        content, data = self.encode()
+        message = Base64Image.too_large().detail[0]
+        self.assertRejected(message, Base64Image.probe, data)
+        self.assertRejected(message, Base64Image.from_string, data)
+        # Padding and line breaks do not slip past the limit while decoding.
+        self.assertRejected(
+            message,
+            Base64Image.decode,
+            [data[:5000], data[5000:6000], data[6000:]],
+        )
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        _, data = self.encode()
+        message = Base64Image.too_many_pixels().detail[0]
+        self.assertRejected(message, Base64Image.probe, data)
+        self.assertRejected(message, Base64Image.from_string, data)
+        _, data = self.encode((30, 30))
+        Base64Image.from_string(data).close()
+
+    def test_invalid_payloads(self):
+        _, bitmap = self.encode(image_format="BMP")
+        _, data = self.encode()
+        truncated = base64.b64encode(base64.b64decode(data)[:2000]).decode()
+        for method in (Base64Image.probe, Base64Image.from_string):
+            self.assertRejected(
+                Base64Image.INVALID_TYPE_MESSAGE, method, bitmap
+            )
+            self.assertRejected(
+                Base64Image.INVALID_TYPE_MESSAGE,
+                method,
+                f"data:text/html;base64,{data}",
+            )
+            self.assertRejected(
+                Base64Image.INVALID_FILE_MESSAGE, method, "не base64!"
+            )
+        self.assertRejected(
+            Base64Image.INVALID_FILE_MESSAGE,
+            Base64Image.from_string,
+            truncated,
+        )
+        self.assertRejected(
+            Base64Image.INVALID_FILE_MESSAGE,
+            Base64Image.from_string,
+            data[:-1],
+        )
+
+
+class ProcessImagesTest(TestCase):
+    def test_failed_job_does_not_stop_the_worker(self):
+        jobs = mock.Mock()
+        jobs.values_list.return_value = ["lost", "next"]
+        with (
+            mock.patch.object(ImageJobRunner, "claimable", return_value=jobs),
+            mock.patch.object(
+                ImageJobRunner, "run", side_effect=(DatabaseError, None)
+            ) as run,
+            self.assertLogs(
+                "api.management.commands.process_images", "ERROR"
+            ) as logs,
+        ):
+            output = StringIO()
+            call_command("process_images", stdout=output)
+        self.assertEqual(run.call_count, 2)
+        self.assertIn("lost", logs.output[0])
+        self.assertIn("Фото: 1", output.getvalue())
+
+
+class ShortLinkTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = Dish.objects.create(
+            author=create_user("author"),
+            name="Борщ",
+            text="Свёкла, капуста",
+            cooking_time=30,
+            image="recipes/images/borsch.jpg",
+        )
+
+    def setUp(self):
+        patcher = mock.patch.object(ShortLinkResolver, "local", LRUCache(100))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(HitCounter, "record")
+        self.record = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def short_link(self, recipe):
+        response = self.client.get(f"/api/recipes/{recipe.pk}/get-link/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["short-link"]
+
+    def test_redirect(self):
+        link = self.short_link(self.recipe)
+        response = self.client.get(link)
+        self.assertRedirects(
+            response,
+            f"/recipes/{self.recipe.pk}/",
+            fetch_redirect_response=False,
+        )
+        self.record.assert_called_once_with(link.split("/")[-2])
+
+    def test_deleted_recipe(self):
+        link = self.short_link(self.recipe)
+        self.recipe.delete()
+        self.assertEqual(self.client.get(link).status_code, 404)
+        self.record.assert_not_called()
+
+    def test_unknown_and_legacy_tokens(self):
+        self.assertEqual(self.client.get("/s/nothing/").status_code, 404)
+        ShortUrl.objects.create(
+            origin_url="/recipes/1/", short_url="/s/legacy/"
+        )
+        response = self.client.get("/s/legacy/")
+        self.assertRedirects(
+            response, "/recipes/1/", fetch_redirect_response=False
+        )
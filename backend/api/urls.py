@@ -3,6 +3,7 @@ from rest_framework.routers import DefaultRouter
 from api.views import (
     ComponentViewSet,
     DishViewSet,
+    ExportJobViewSet,
     ProfileViewSet,
     ShortLinkRedirectView,
 )
@@ -11,6 +12,11 @@ app_name = "api"
 
 router_v1 = DefaultRouter()
 router_v1.register("ingredients", ComponentViewSet, basename="ingredients")
+router_v1.register(
+    "recipes/shopping_cart_exports",
+    ExportJobViewSet,
+    basename="shopping-cart-exports",
+)
 router_v1.register("recipes", DishViewSet, basename="recipes")
 router_v1.register("users", ProfileViewSet, basename="users")
 
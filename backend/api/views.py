@@ -1,35 +1,52 @@
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets
 from rest_framework.permissions import (
     AllowAny,
     IsAuthenticated,
     IsAuthenticatedOrReadOnly,
 )
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect
-from django.http import FileResponse
+from django.http import FileResponse, Http404
 from rest_framework import viewsets, permissions
 from djoser.views import UserViewSet
+from ingredients.index import IngredientIndex
 from ingredients.models import IngredientModel
-from recipes.models import Dish, FavoriteDish, ShoppingCart, ShortUrl
+from recipes.models import Dish, ExportJob, FavoriteDish, ShoppingCart
 from users.models import SubscriptionPlan, BlogerUser
+from recipes.feed import FeedTimeline
+from recipes.similarity import RecipeSimilarityIndex
+from recipes.utils import encode_recipe_id
+from foodgram.const import MAX_SIMILAR_RECIPES, SIMILAR_RECIPES_LIMIT
 from core.permissons import IsAuthorOrReadOnlyPermisson
 from api.filters import ComponentFilter, DishFilter
+from api.renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
 from api.serializers import (
     ComponentSerializer,
     DishSerializer,
     CartSerializer,
     FavoriteDishSerializer,
+    CartTotalSerializer,
+    ExportJobSerializer,
     EnhancedUserSerializer,
     SubscriptionHandlerSerializer,
     FollowSerializer,
     ProfileImageSerializer,
     IngredientSerializer,
 )
-from api.services import DishManager
+from api.jobs import ExportWorkerPool
+from api.shortlinks import HitCounter, ShortLinkResolver
+from api.services import (
+    CartProcessor,
+    CatalogManager,
+    DishManager,
+    ExportJobRunner,
+)
 from django.conf import settings
 from django.contrib.auth import get_user_model
 
@@ -42,11 +59,11 @@ class ComponentViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.AllowAny]
     pagination_class = None
 
-    def get_queryset(self):
-        name = self.request.query_params.get("name")
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get("name")
         if name:
-            return self.queryset.filter(name__startswith=name)
-        return self.queryset
+            return Response(IngredientIndex.search(name))
+        return CatalogManager.respond(request)
 
 
 class DishViewSet(viewsets.ModelViewSet):
@@ -57,12 +74,52 @@ class DishViewSet(viewsets.ModelViewSet):
     filterset_fields = ("author",)
     filterset_class = DishFilter
 
+    def get_queryset(self):
+        return self.queryset.visible_to(self.request.user).with_user_flags(
+            self.request.user
+        )
+
+    @action(
+        methods=("GET",), detail=False, permission_classes=(IsAuthenticated,)
+    )
+    def feed(self, request):
+        queryset = self.get_queryset()
+        page = self.paginator.paginate_keyset(
+            request,
+            FeedTimeline.fields(),
+            lambda position, limit, reverse: FeedTimeline.fetch(
+                request.user, queryset, position, limit, reverse
+            ),
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=("GET",), detail=True, url_path="similar")
+    def similar(self, request, pk=None):
+        dish = get_object_or_404(Dish.objects.only("pk"), pk=pk)
+        try:
+            limit = int(request.query_params["limit"])
+        except (KeyError, ValueError):
+            limit = SIMILAR_RECIPES_LIMIT
+        limit = min(max(limit, 1), MAX_SIMILAR_RECIPES)
+        # A few spare ids cover recipes deleted in another worker since the
+        # index there was synced.
+        ids = RecipeSimilarityIndex.similar(dish.pk, limit * 2)
+        dishes = self.get_queryset().filter(pk__in=ids).in_bulk()
+        serializer = self.get_serializer(
+            [dishes[pk] for pk in ids if pk in dishes][:limit], many=True
+        )
+        return Response(serializer.data)
+
     @action(methods=("GET",), detail=True, url_path="get-link", url_name="get-link")
     def fetch_short_link(self, request, pk=None):
-        origin_url = f"/recipes/{pk}/"
-        short_url_obj, _ = ShortUrl.objects.get_or_create(origin_url=origin_url)
+        dish = get_object_or_404(Dish.objects.only("pk"), pk=pk)
         return Response(
-            {"short-link": request.build_absolute_uri(short_url_obj.short_url)}
+            {
+                "short-link": request.build_absolute_uri(
+                    f"/s/{encode_recipe_id(dish.pk)}/"
+                )
+            }
         )
 
     @action(
@@ -96,18 +153,79 @@ class DishViewSet(viewsets.ModelViewSet):
         detail=False,
         permission_classes=(IsAuthenticated,),
         url_path="download_shopping_cart",
+        renderer_classes=(
+            JSONRenderer,
+            PDFRenderer,
+            PlainTextRenderer,
+            CSVRenderer,
+        ),
     )
     def download_cart(self, request):
+        return DishManager.export_cart(
+            request, request.query_params.get("format", "pdf")
+        )
+
+    @action(
+        methods=("GET",),
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        url_path="shopping_cart_totals",
+    )
+    def cart_totals(self, request):
+        serializer = CartTotalSerializer(
+            CartProcessor.fetch_cart_totals(request.user), many=True
+        )
+        return Response(serializer.data)
+
+
+class ExportJobViewSet(
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+):
+    serializer_class = ExportJobSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user=self.request.user)
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ExportJobRunner.expire(self.get_queryset())
+        job = serializer.save(user=request.user)
+        if not ExportWorkerPool.submit(ExportJobRunner.run, job.pk):
+            job.delete()
+            return Response(
+                {
+                    "detail": (
+                        "Слишком много выгрузок в очереди, попробуйте позже"
+                    )
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(
+        methods=("GET",), detail=True, url_path="download", url_name="download"
+    )
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ExportJob.Status.DONE:
+            return Response(
+                {"detail": "Файл ещё не готов"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        filename = settings.NAME_SHOPPING_CART_LIST_FILE
         return FileResponse(
-            DishManager.generate_pdf(request),
+            job.file.open("rb"),
             as_attachment=True,
-            filename=f"{settings.NAME_SHOPPING_CART_LIST_FILE}.pdf",
+            filename=f"{filename}.{job.export_format}",
         )
 
 
 class ProfileViewSet(UserViewSet):
     queryset = User.objects.all()
     permission_classes = [permissions.AllowAny]
+    cursor_ordering = ("-date_joined", "-id")
 
     @action(
         detail=False,
@@ -154,7 +272,11 @@ class ProfileViewSet(UserViewSet):
         url_path="subscriptions",
     )
     def get_follows(self, request):
-        authors = User.objects.filter(subscribers__user=request.user)
+        authors = (
+            User.objects.filter(subscribers__user=request.user)
+            .with_is_subscribed(request.user)
+            .with_recipes(FollowSerializer.get_recipes_limit(request))
+        )
         page = self.paginate_queryset(authors)
         serializer = FollowSerializer(page, many=True, context={"request": request})
         return self.get_paginated_response(serializer.data)
@@ -165,6 +287,7 @@ class ProfileViewSet(UserViewSet):
         permission_classes=(permissions.IsAuthenticated,),
         url_path="subscribe",
     )
+    @transaction.atomic
     def follow(self, request, id):
         get_object_or_404(User, pk=id)
         serializer = SubscriptionHandlerSerializer(
@@ -176,6 +299,7 @@ class ProfileViewSet(UserViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @follow.mapping.delete
+    @transaction.atomic
     def unfollow(self, request, id):
         author = self.get_object()
         deleted, _ = request.user.subscriptions.filter(author=author).delete()
@@ -192,6 +316,8 @@ class ShortLinkRedirectView(APIView):
     permission_classes = []
 
     def get(self, request, token):
-        short_url = f"/s/{token}/"
-        obj = get_object_or_404(ShortUrl, short_url=short_url)
-        return redirect(obj.origin_url)
+        target = ShortLinkResolver.resolve(token)
+        if target is None:
+            raise Http404
+        HitCounter.record(token)
+        return redirect(target)
@@ -0,0 +1,21 @@
+class CounterFieldsMixin:
+    # Counters (and flags kept next to them) only change through update()
+    # queries. A full save of an instance loaded earlier (admin forms,
+    # djoser, password changes) writes every other field and leaves the
+    # counters to the database.
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and not self._state.adding
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+        ):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
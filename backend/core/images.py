@@ -0,0 +1,270 @@
+import base64
+import binascii
+import logging
+import os
+import uuid
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class ImageVariants:
+    # Every upload is re-encoded without EXIF/ICC metadata and accompanied by
+    # the WebP sizes from settings.IMAGE_VARIANTS. Files are named after the
+    # hash of their content, so a name never points to different bytes.
+
+    # What Pillow raises for a missing, truncated or oversized file.
+    ERRORS = (OSError, UnidentifiedImageError, Image.DecompressionBombError)
+
+    @staticmethod
+    def flatten(image):
+        if image.mode in ("RGB", "RGBA"):
+            return image
+        if image.mode in ("LA", "PA") or "transparency" in image.info:
+            return image.convert("RGBA")
+        return image.convert("RGB")
+
+    @staticmethod
+    def encode(image, image_format, **options):
+        output = BytesIO()
+        image.save(output, format=image_format, **options)
+        return output.getvalue()
+
+    @staticmethod
+    def store(storage, directory, content, extension):
+        # ContentAddressedStorage names the file after its bytes and keeps
+        # one copy of them, whatever name is asked for.
+        return storage.save(
+            f"{directory}image.{extension}", ContentFile(content)
+        )
+
+    @staticmethod
+    def outdated(instance, field):
+        field_file = getattr(instance, field)
+        variants = getattr(instance, f"{field}_variants") or {}
+        if not field_file:
+            return bool(variants)
+        return variants.get("original") != field_file.name
+
+    @classmethod
+    def build(cls, storage, directory, file):
+        with file.open("rb"):
+            image = Image.open(file)
+            image_format = image.format or "PNG"
+            image = ImageOps.exif_transpose(image)
+        if image_format == "JPEG":
+            image = image.convert("RGB")
+            original = cls.encode(image, "JPEG", quality=90, optimize=True)
+        else:
+            image_format = "PNG"
+            original = cls.encode(cls.flatten(image), "PNG", optimize=True)
+        names = {
+            "original": cls.store(
+                storage,
+                directory,
+                original,
+                "jpg" if image_format == "JPEG" else "png",
+            )
+        }
+        for variant, size in settings.IMAGE_VARIANTS.items():
+            resized = cls.flatten(image).copy()
+            resized.thumbnail(size, Image.Resampling.LANCZOS)
+            content = cls.encode(
+                resized, "WEBP", quality=settings.IMAGE_WEBP_QUALITY, method=4
+            )
+            names[variant] = cls.store(
+                storage, os.path.join(directory, variant, ""), content, "webp"
+            )
+        return names
+
+    @classmethod
+    def refresh(cls, model, pk, field):
+        # Runs in ImageWorkerPool after a row got a new photo or lost it.
+        instance = model._default_manager.filter(pk=pk).first()
+        if instance is None or not cls.outdated(instance, field):
+            return
+        field_file = getattr(instance, field)
+        variants_field = f"{field}_variants"
+        names = {}
+        if field_file:
+            try:
+                names = cls.build(
+                    field_file.storage, field_file.field.upload_to, field_file
+                )
+            except cls.ERRORS:
+                logger.exception(
+                    "Не удалось подготовить варианты %s", field_file.name
+                )
+                return
+        with transaction.atomic():
+            stored = (
+                model._default_manager.select_for_update()
+                .filter(pk=instance.pk)
+                .values_list(field, flat=True)
+            )
+            # The row may have been deleted or given another photo while the
+            # variants were rendered; that photo renders its own.
+            if [name or "" for name in stored] != [field_file.name or ""]:
+                return
+            setattr(instance, variants_field, names)
+            if names:
+                # The upload itself is left to `collect_media`, the same
+                # bytes may be stored for another row.
+                setattr(instance, field, names["original"])
+            instance.save(update_fields=(field, variants_field))
+
+
+class Base64Image:
+    # Decodes a base64 upload chunk by chunk into a spooled temporary file,
+    # so only one chunk of decoded bytes is held at a time. The byte limit
+    # is checked before and during decoding, the pixel limit as soon as the
+    # header has arrived, and Pillow reads from the file handle.
+
+    FORMATS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif"}
+    SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+    INVALID_FILE_MESSAGE = "Загрузите корректное изображение."
+    INVALID_TYPE_MESSAGE = "Поддерживаются только JPEG, PNG и GIF."
+
+    @staticmethod
+    def offset(data):
+        # Position of the base64 payload behind an optional data URI header.
+        header_end = data.find(";base64,", 0, 256)
+        if header_end == -1:
+            return 0
+        if not data.startswith("data:image/"):
+            raise ValidationError(Base64Image.INVALID_TYPE_MESSAGE)
+        return header_end + len(";base64,")
+
+    @staticmethod
+    def chunks(data, start=0):
+        for position in range(start, len(data), UPLOAD_CHUNK_SIZE):
+            end = position + UPLOAD_CHUNK_SIZE
+            yield data[position:end]
+
+    @staticmethod
+    def too_large():
+        return ValidationError(
+            "Размер изображения не должен превышать "
+            f"{settings.IMAGE_UPLOAD_MAX_BYTES // (1024 * 1024)} МБ."
+        )
+
+    @staticmethod
+    def too_many_pixels():
+        return ValidationError(
+            "Изображение не должно превышать "
+            f"{settings.IMAGE_MAX_PIXELS // 1_000_000} Мп."
+        )
+
+    @classmethod
+    def check_length(cls, encoded_length):
+        if encoded_length // 4 * 3 > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise cls.too_large()
+
+    @classmethod
+    def check_header(cls, stream, complete):
+        # True once the dimensions are known and within the limit.
+        stream.seek(0)
+        if not stream.read(8).startswith(cls.SIGNATURES):
+            raise ValidationError(cls.INVALID_TYPE_MESSAGE)
+        stream.seek(0)
+        try:
+            image = Image.open(stream)
+        except Image.DecompressionBombError:
+            raise cls.too_many_pixels()
+        except (UnidentifiedImageError, OSError):
+            if complete:
+                raise ValidationError(cls.INVALID_FILE_MESSAGE)
+            return False
+        finally:
+            stream.seek(0, os.SEEK_END)
+        width, height = image.size
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            raise cls.too_many_pixels()
+        return True
+
+    @classmethod
+    def decode(cls, chunks):
+        stream = SpooledTemporaryFile(
+            max_size=settings.IMAGE_UPLOAD_SPOOL_SIZE
+        )
+        pending = b""
+        checked = False
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("ascii", errors="replace")
+                chunk = pending + b"".join(chunk.split())
+                cut = len(chunk) - len(chunk) % 4
+                pending = chunk[cut:]
+                try:
+                    stream.write(base64.b64decode(chunk[:cut], validate=True))
+                except (binascii.Error, ValueError):
+                    raise ValidationError(cls.INVALID_FILE_MESSAGE)
+                if stream.tell() > settings.IMAGE_UPLOAD_MAX_BYTES:
+                    raise cls.too_large()
+                if not checked and stream.tell() >= 8:
+                    checked = cls.check_header(stream, complete=False)
+            if pending or not stream.tell():
+                raise ValidationError(cls.INVALID_FILE_MESSAGE)
+            cls.check_header(stream, complete=True)
+            return cls.verify(stream)
+        except BaseException:
+            stream.close()
+            raise
+
+    @classmethod
+    def verify(cls, stream):
+        size = stream.tell()
+        stream.seek(0)
+        try:
+            image = Image.open(stream)
+            image_format = image.format
+            image.verify()
+        except Exception:
+            raise ValidationError(cls.INVALID_FILE_MESSAGE)
+        if image_format not in cls.FORMATS:
+            raise ValidationError(cls.INVALID_TYPE_MESSAGE)
+        stream.seek(0)
+        return UploadedFile(
+            stream,
+            name=f"{uuid.uuid4()}.{cls.FORMATS[image_format]}",
+            content_type=Image.MIME[image_format],
+            size=size,
+        )
+
+    @classmethod
+    def probe(cls, data):
+        # Request-time check of the size, the signature and, when the header
+        # fits into the first chunk, the dimensions. Returns the offset.
+        start = cls.offset(data)
+        cls.check_length(len(data) - start)
+        end = start + UPLOAD_CHUNK_SIZE
+        head = b"".join(
+            data[start:end].encode("ascii", errors="replace").split()
+        )
+        try:
+            decoded = base64.b64decode(
+                head[: len(head) - len(head) % 4], validate=True
+            )
+        except (binascii.Error, ValueError):
+            raise ValidationError(cls.INVALID_FILE_MESSAGE)
+        with BytesIO(decoded) as stream:
+            stream.seek(0, os.SEEK_END)
+            cls.check_header(stream, complete=False)
+        return start
+
+    @classmethod
+    def from_string(cls, data):
+        start = cls.offset(data)
+        cls.check_length(len(data) - start)
+        return cls.decode(cls.chunks(data, start))
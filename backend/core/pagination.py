@@ -1,13 +1,234 @@
+import base64
+import hashlib
+import json
+import uuid
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CountCache:
+    # Counts are cached per SQL statement, so every filter combination (and
+    # every user, for the per-user flags) gets its own entry. Writes replace
+    # the version key, which orphans all of them at once.
+
+    version_key = "pagination-count-version"
+
+    @staticmethod
+    def cache():
+        return caches[settings.PAGINATION_COUNT_CACHE]
+
+    @classmethod
+    def invalidate(cls):
+        cls.cache().set(cls.version_key, uuid.uuid4().hex, None)
+
+    @classmethod
+    def count(cls, queryset):
+        estimate = cls.estimate(queryset)
+        if estimate is not None:
+            return estimate
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        cache = cls.cache()
+        version = cache.get_or_set(
+            cls.version_key, lambda: uuid.uuid4().hex, None
+        )
+        key = (
+            "pagination-count:"
+            + hashlib.sha256(
+                f"{version}:{queryset.db}:{sql}:{params!r}".encode()
+            ).hexdigest()
+        )
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_TIMEOUT)
+        return count
+
+    @staticmethod
+    def estimate(queryset):
+        # The planner statistics are only close enough for large unfiltered
+        # tables; small or never analyzed ones (reltuples = -1) are counted.
+        connection = connections[queryset.db]
+        if (
+            not settings.PAGINATION_ESTIMATE_COUNTS
+            or connection.vendor != "postgresql"
+            or queryset.query.where
+            or queryset.query.distinct
+        ):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < settings.PAGINATION_ESTIMATE_THRESHOLD:
+            return None
+        return int(row[0])
+
+
+class CountingPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return CountCache.count(self.object_list)
 
 
 class CustomPagePaginator(PageNumberPagination):
+    django_paginator_class = CountingPaginator
     page_size = 6
     page_size_query_param = "limit"
     max_page_size = 100
+    # ?cursor= switches a list to keyset pagination: no COUNT(*) and no
+    # OFFSET scan, the page starts right after the last row seen.
+    cursor_query_param = "cursor"
+    cursor_ordering = ("-created_at", "-id")
+    invalid_cursor_message = "Неверный курсор."
+    unordered_cursor_message = (
+        "Курсор не сочетается с сортировкой и поиском, используйте page."
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        ordering = getattr(view, "cursor_ordering", self.cursor_ordering)
+        if queryset.query.order_by and tuple(queryset.query.order_by) != tuple(
+            ordering
+        ):
+            # ?ordering= and ?search= order by scores the cursor cannot hold,
+            # re-ordering by the keyset would silently drop them.
+            raise ParseError(self.unordered_cursor_message)
+        return self.paginate_by_cursor(queryset, request, ordering)
+
+    def paginate_by_cursor(self, queryset, request, ordering):
+        fields = [
+            queryset.model._meta.get_field(name.lstrip("-"))
+            for name in ordering
+        ]
+
+        def fetch(position, limit, reverse):
+            rows = queryset.order_by(*self.directed(ordering, reverse))
+            if position is not None:
+                rows = rows.filter(
+                    self.after(
+                        self.directed(ordering, reverse), fields, position
+                    )
+                )
+            return list(rows[:limit])
+
+        return self.paginate_keyset(request, fields, fetch)
+
+    def paginate_keyset(self, request, fields, fetch):
+        # fetch(position, limit, reverse) returns up to ``limit`` objects that
+        # follow ``position`` in the direction of travel.
+        self.cursor_mode = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, fields)
+        results = fetch(position, page_size + 1, reverse)
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+        first = self.position(fields, results[0]) if results else position
+        last = self.position(fields, results[-1]) if results else position
+        has_next = has_more if not reverse else position is not None
+        has_previous = has_more if reverse else position is not None
+        self.next_cursor = (last, False) if has_next and last else None
+        self.previous_cursor = (
+            (first, True) if has_previous and first else None
+        )
+        return results
+
+    @staticmethod
+    def directed(ordering, reverse):
+        if not reverse:
+            return list(ordering)
+        return [
+            name[1:] if name.startswith("-") else f"-{name}"
+            for name in ordering
+        ]
+
+    @staticmethod
+    def after(ordering, fields, position):
+        # (a, b) > (x, y) is spelled a > x OR (a = x AND b > y) so that every
+        # column can have its own direction and still use the composite index.
+        conditions = []
+        for index, name in enumerate(ordering):
+            lookup = "lt" if name.startswith("-") else "gt"
+            equal = {
+                field.attname: value
+                for field, value in zip(fields[:index], position[:index])
+            }
+            conditions.append(
+                Q(
+                    **equal,
+                    **{f"{fields[index].attname}__{lookup}": position[index]},
+                )
+            )
+        return reduce(or_, conditions)
+
+    @staticmethod
+    def position(fields, obj):
+        return [field.value_to_string(obj) for field in fields]
+
+    def decode_cursor(self, request, fields):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(
+                base64.urlsafe_b64decode(encoded.encode("ascii"))
+            )
+            if len(data["p"]) != len(fields):
+                raise ValueError
+            position = [
+                field.to_python(value)
+                for field, value in zip(fields, data["p"])
+            ]
+            return position, bool(data.get("r"))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        if cursor is None:
+            return None
+        position, reverse = cursor
+        data = {"p": [str(value) for value in position]}
+        if reverse:
+            data["r"] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode()).decode(
+            "ascii"
+        )
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, encoded)
 
     def get_paginated_response(self, data):
+        if self.cursor_mode:
+            return Response(
+                {
+                    "next": self.encode_cursor(self.next_cursor),
+                    "previous": self.encode_cursor(self.previous_cursor),
+                    "results": data,
+                }
+            )
         return Response(
             {
                 "count": self.page.paginator.count,
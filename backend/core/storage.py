@@ -0,0 +1,42 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Every file is stored once, under the sha256 of its bytes, whatever
+    # name or upload_to it was saved with. A name therefore always means the
+    # same content and its URL may be cached forever. Files are shared
+    # between rows, so they are only removed by `manage.py collect_media`.
+
+    def __init__(self, prefix=None, **kwargs):
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(**kwargs)
+        self.prefix = (
+            settings.CONTENT_STORAGE_PREFIX if prefix is None else prefix
+        )
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        directory = f"{self.prefix}{hexdigest[:2]}/{hexdigest[2:4]}"
+        return f"{directory}/{hexdigest}{extension}"
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content in _save.
+        return name
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # A reused file starts a new grace period for the collector.
+            os.utime(self.path(name))
+            return name
+        # A concurrent save of the same bytes writes identical content.
+        return super()._save(name, content)
@@ -0,0 +1,82 @@
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+def create_user(username, **extra):
+    return get_user_model().objects.create_user(
+        email=f"{username}@example.com",
+        username=username,
+        first_name="Имя",
+        last_name="Фамилия",
+        **extra,
+    )
+
+
+class AdminQueriesMixin:
+    # A changelist must cost the same number of queries whatever the number
+    # of rows on the page. Test cases fill the page with create_rows().
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = create_user("admin", password=None)
+        cls.admin.is_staff = cls.admin.is_superuser = True
+        cls.admin.save(update_fields=("is_staff", "is_superuser"))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.created = 0
+
+    def create_rows(self, count):
+        raise NotImplementedError
+
+    def count_queries(self, url):
+        # The first request fills the cached count of the changelist.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueriesConstant(self, url, add_rows):
+        expected = self.count_queries(url)
+        add_rows()
+        self.client.get(url)
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+
+    def assertChangelistScales(self, model, query=""):
+        opts = model._meta
+        url = reverse(f"admin:{opts.app_label}_{opts.model_name}_changelist")
+        self.create_rows(2)
+        self.assertQueriesConstant(url + query, lambda: self.create_rows(10))
+
+
+class BackgroundJobsMixin:
+    def run_jobs_inline(self, pool):
+        # Jobs run in the test's thread, once the change commits.
+        patcher = mock.patch.object(
+            pool, "submit", side_effect=lambda task, *args: task(*args) or True
+        )
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def skip_jobs(self, pool):
+        patcher = mock.patch.object(pool, "submit", return_value=True)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def use_temporary_media(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        return media.name
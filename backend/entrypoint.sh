@@ -43,10 +43,67 @@ load_fixtures() {
     fi
 }
 
+repair_counters() {
+    echo "Recounting favorites and recipes..."
+    if python manage.py recount; then
+        echo "Counters are up to date"
+    else
+        echo "Error recounting" >&2
+        exit 1
+    fi
+}
+
+collect_media() {
+    echo "Removing unused media files..."
+    if python manage.py collect_media --full; then
+        echo "Media files collected"
+    else
+        echo "Error collecting media files" >&2
+    fi
+}
+
+build_indexes() {
+    echo "Building similar recipes index..."
+    if python manage.py build_similarity_index; then
+        echo "Index built successfully"
+    else
+        echo "Error building index, workers will build it on demand" >&2
+    fi
+    if python manage.py rebuild_feed; then
+        echo "Feeds rebuilt"
+    else
+        echo "Error rebuilding feeds" >&2
+    fi
+    if python manage.py update_recipe_scores; then
+        echo "Recipe scores updated"
+    else
+        echo "Error updating recipe scores" >&2
+    fi
+}
+
+expire_exports() {
+    echo "Removing old shopping list exports..."
+    if python manage.py expire_exports; then
+        echo "Exports expired"
+    else
+        echo "Error expiring exports" >&2
+    fi
+}
+
+start_image_worker() {
+    echo "Starting image worker..."
+    python manage.py process_images --loop &
+}
+
 main() {
     perform_migrations
     collect_static_files
     load_fixtures
+    repair_counters
+    collect_media
+    expire_exports
+    build_indexes
+    start_image_worker
 
     echo "Starting Gunicorn server..."
     exec gunicorn --bind 0.0.0.0:8000 --timeout 90 foodgram.wsgi
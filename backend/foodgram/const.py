@@ -17,3 +17,7 @@ MAX_COOKING_TIME = 32_000
 
 CHARACTERS_SHORT_URL = "ABCDEFGHJKLMNOPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz1234567890"
 TOKEN_LENGTH_SHORT_URL = 6
+
+# Similar recipes
+SIMILAR_RECIPES_LIMIT = 6
+MAX_SIMILAR_RECIPES = 50
@@ -51,6 +51,7 @@ INSTALLED_APPS = [
     "ingredients.apps.IngredientConfig",
     "users.apps.UsersConfig",
     "recipes.apps.RecipesConfig",
+    "api.apps.ApiConfig",
 ]
 
 MIDDLEWARE = [
@@ -96,6 +97,46 @@ DATABASES = {
         "PORT": os.getenv("DB_PORT", ""),
     }
 }
+if DATABASES["default"]["ENGINE"].endswith("sqlite3"):
+    # Transactions take the write lock as they begin. A worker's SELECT then
+    # UPDATE waits for a concurrent request instead of failing with
+    # "database is locked" when its read lock is upgraded.
+    DATABASES["default"]["OPTIONS"] = {
+        "transaction_mode": "IMMEDIATE",
+        "timeout": 20,
+    }
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+SHOPPING_LIST_CACHE_MAX_ENTRIES = int(
+    os.getenv("SHOPPING_LIST_CACHE_MAX_ENTRIES", 300)
+)
+# Total size of rendered lists one process may keep. Every entry gets an
+# equal share, so a full cache stays within the budget.
+SHOPPING_LIST_CACHE_MAX_BYTES = int(
+    os.getenv("SHOPPING_LIST_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+SHOPPING_LIST_CACHE_MAX_ITEM_SIZE = (
+    SHOPPING_LIST_CACHE_MAX_BYTES // SHOPPING_LIST_CACHE_MAX_ENTRIES
+)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shopping_lists": {
+        "BACKEND": os.getenv(
+            "SHOPPING_LIST_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv(
+            "SHOPPING_LIST_CACHE_LOCATION", "shopping_lists"
+        ),
+        "TIMEOUT": 60 * 60 * 24,
+        "OPTIONS": {
+            "MAX_ENTRIES": SHOPPING_LIST_CACHE_MAX_ENTRIES,
+        },
+    },
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,6 +196,11 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static_backend")
 MEDIA_URL = "/media_backend/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media_backend")
 
+# Rendered shopping lists are private, so they are kept outside MEDIA_ROOT
+EXPORTS_ROOT = os.path.join(BASE_DIR, "exports")
+# Raw recipe photo uploads waiting for the image workers
+IMAGE_UPLOADS_ROOT = os.path.join(BASE_DIR, "uploads")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -164,8 +210,87 @@ AUTH_USER_MODEL = "users.BlogerUser"
 CORS_ALLOWED_ORIGINS = [
     host for host in os.getenv("CORS_ALLOWED_HOSTS", "").split(",") if host
 ]
+# Photos and avatars are stored once per content under this folder
+STORAGES = {
+    "default": {"BACKEND": "core.storage.ContentAddressedStorage"},
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+    },
+}
+CONTENT_STORAGE_PREFIX = "content/"
+# Unreferenced media files younger than this are kept by collect_media
+MEDIA_GC_GRACE = int(os.getenv("MEDIA_GC_GRACE", 24 * 60 * 60))
 UPLOAD_AVATAR = "users/images/"
 UPLOAD_RECIPES = "recipes/images/"
+# WebP sizes rendered for every uploaded recipe photo and avatar
+IMAGE_VARIANTS = {"thumb": (320, 320), "webp": (1600, 1600)}
+IMAGE_WEBP_QUALITY = 80
+# Limits checked while a base64 upload is decoded, before Pillow loads pixels
+IMAGE_UPLOAD_MAX_BYTES = int(
+    os.getenv("IMAGE_UPLOAD_MAX_BYTES", 8 * 1024 * 1024)
+)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+# Decoded uploads larger than this are spooled to disk
+IMAGE_UPLOAD_SPOOL_SIZE = int(
+    os.getenv("IMAGE_UPLOAD_SPOOL_SIZE", 1024 * 1024)
+)
 CHARACTERS_SHORT_URL = "ABCDEFGHJKLMNOPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz1234567890"
 TOKEN_LENGTH_SHORT_URL = 6
+# Recipe short codes are one character longer than the legacy random tokens,
+# so both kinds of /s/<token>/ links can be told apart by length.
+SHORT_CODE_LENGTH = TOKEN_LENGTH_SHORT_URL + 1
+SHORT_CODE_MULTIPLIER = int(os.getenv("SHORT_CODE_MULTIPLIER", 1730099626607))
+SHORT_CODE_OFFSET = int(os.getenv("SHORT_CODE_OFFSET", 1125899906))
 NAME_SHOPPING_CART_LIST_FILE = "shopping_list"
+SHOPPING_LIST_CACHE = "shopping_lists"
+INGREDIENT_INDEX_TTL = int(os.getenv("INGREDIENT_INDEX_TTL", 300))
+RECIPE_INGREDIENT_INDEX_TTL = int(
+    os.getenv("RECIPE_INGREDIENT_INDEX_TTL", 300)
+)
+# Written by `manage.py build_similarity_index`, loaded by every worker
+SIMILARITY_INDEX_PATH = os.getenv(
+    "SIMILARITY_INDEX_PATH",
+    os.path.join(BASE_DIR, "indexes", "similarity.npz"),
+)
+SIMILARITY_INDEX_REFRESH = int(os.getenv("SIMILARITY_INDEX_REFRESH", 60))
+SIMILARITY_INDEX_MAX_DELTA = int(os.getenv("SIMILARITY_INDEX_MAX_DELTA", 5000))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+EXPORT_QUEUE_SIZE = int(os.getenv("EXPORT_QUEUE_SIZE", 20))
+# Unfinished exports older than this are failed, finished ones are deleted
+# together with their files after EXPORT_JOB_TTL
+EXPORT_JOB_TIMEOUT = int(os.getenv("EXPORT_JOB_TIMEOUT", 10 * 60))
+EXPORT_JOB_TTL = int(os.getenv("EXPORT_JOB_TTL", 24 * 60 * 60))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", 50))
+# A job claimed longer ago than this is assumed lost and is run again
+IMAGE_JOB_TIMEOUT = int(os.getenv("IMAGE_JOB_TIMEOUT", 300))
+PAGINATION_COUNT_CACHE = "default"
+PAGINATION_COUNT_TIMEOUT = int(os.getenv("PAGINATION_COUNT_TIMEOUT", 30))
+# Unfiltered lists on PostgreSQL may show the planner's row estimate
+PAGINATION_ESTIMATE_COUNTS = (
+    os.getenv("PAGINATION_ESTIMATE_COUNTS", "False").lower() == "true"
+)
+PAGINATION_ESTIMATE_THRESHOLD = int(
+    os.getenv("PAGINATION_ESTIMATE_THRESHOLD", 10000)
+)
+TRENDING_HALF_LIFE_HOURS = int(os.getenv("TRENDING_HALF_LIFE_HOURS", 48))
+# Scores of recipes with new favorites or cart adds are rewritten in one batch
+# once this many recipes are pending or the interval has passed
+RANKING_ACTIVITY_THRESHOLD = int(os.getenv("RANKING_ACTIVITY_THRESHOLD", 100))
+RANKING_FLUSH_INTERVAL = int(os.getenv("RANKING_FLUSH_INTERVAL", 60))
+# Authors with more followers are read into feeds instead of pushed to them.
+# They are pushed again only once back at FEED_PUSH_LIMIT, so follows and
+# unfollows around the limit do not switch the mode back and forth.
+FEED_FANOUT_LIMIT = int(os.getenv("FEED_FANOUT_LIMIT", 1000))
+FEED_PUSH_LIMIT = int(
+    os.getenv("FEED_PUSH_LIMIT", FEED_FANOUT_LIMIT * 9 // 10)
+)
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", 1))
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", 20))
+SHORT_LINK_CACHE_SIZE = int(os.getenv("SHORT_LINK_CACHE_SIZE", 10000))
+# Name of a CACHES alias shared between workers; empty disables that tier
+SHORT_LINK_CACHE = os.getenv("SHORT_LINK_CACHE", "")
+SHORT_LINK_CACHE_TIMEOUT = 60 * 60
+SHORT_LINK_MISS_TIMEOUT = 60
+SHORT_LINK_FLUSH_THRESHOLD = int(os.getenv("SHORT_LINK_FLUSH_THRESHOLD", 500))
+SHORT_LINK_FLUSH_INTERVAL = int(os.getenv("SHORT_LINK_FLUSH_INTERVAL", 30))
@@ -2,10 +2,12 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
+from api.views import ShortLinkRedirectView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
+    path("s/<str:token>/", ShortLinkRedirectView.as_view(), name="short-link"),
 ]
 
 if settings.DEBUG:
@@ -1,4 +1,7 @@
 from django.contrib import admin
+from django.db.models import Q
+from core.pagination import CountingPaginator
+from .index import IngredientIndex
 from .models import IngredientModel
 
 
@@ -12,3 +15,15 @@ class IngredientAdmin(admin.ModelAdmin):
         "name",
         "measurement_unit",
     )
+    paginator = CountingPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Prefix search from the in-memory index that also serves autocomplete.
+        if not search_term:
+            return queryset, False
+        found = [item["id"] for item in IngredientIndex.search(search_term)]
+        return (
+            queryset.filter(Q(pk__in=found) | Q(measurement_unit=search_term)),
+            False,
+        )
@@ -0,0 +1,90 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+from .models import IngredientModel
+
+
+class IngredientIndex:
+    # Sorted (key, name, id, measurement_unit) rows, searched with bisect.
+    _entries = []
+    _keys = []
+    _catalog = None
+    _built_at = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text):
+        return text.casefold().replace("ё", "е")
+
+    @classmethod
+    def invalidate(cls):
+        cls._built_at = None
+
+    @classmethod
+    def rebuild(cls):
+        entries = sorted(
+            (cls.normalize(name), name, pk, unit)
+            for pk, name, unit in IngredientModel.objects.values_list(
+                "id", "name", "measurement_unit"
+            )
+        )
+        catalog = cls._render_catalog(entries)
+        with cls._lock:
+            cls._entries = entries
+            cls._keys = [entry[0] for entry in entries]
+            cls._catalog = catalog
+            cls._built_at = time.monotonic()
+
+    @staticmethod
+    def _render_catalog(entries):
+        body = json.dumps(
+            [
+                {"id": pk, "name": name, "measurement_unit": unit}
+                for _, name, pk, unit in entries
+            ],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+        return (
+            body,
+            gzip.compress(body, mtime=0),
+            hashlib.sha256(body).hexdigest(),
+        )
+
+    @classmethod
+    def ensure_fresh(cls):
+        # Signals only reach this process, so other workers rely on the TTL.
+        built_at = cls._built_at
+        if built_at is None or (
+            time.monotonic() - built_at > settings.INGREDIENT_INDEX_TTL
+        ):
+            cls.rebuild()
+
+    @classmethod
+    def catalog(cls):
+        cls.ensure_fresh()
+        return cls._catalog
+
+    @classmethod
+    def search(cls, prefix):
+        cls.ensure_fresh()
+        with cls._lock:
+            entries, keys = cls._entries, cls._keys
+        query = cls.normalize(prefix)
+        start = bisect_left(keys, query)
+        end = bisect_right(keys, query + chr(0x10FFFF), lo=start)
+        matches = sorted(
+            entries[start:end],
+            key=lambda entry: (
+                entry[0] != query,
+                not entry[1].startswith(prefix),
+            ),
+        )
+        return [
+            {"id": pk, "name": name, "measurement_unit": unit}
+            for _, name, pk, unit in matches
+        ]
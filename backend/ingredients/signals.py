@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .index import IngredientIndex
+from .models import IngredientModel
+
+
+@receiver(post_save, sender=IngredientModel)
+@receiver(post_delete, sender=IngredientModel)
+def invalidate_index(sender, **kwargs):
+    IngredientIndex.invalidate()
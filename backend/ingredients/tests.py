@@ -0,0 +1,19 @@
+from django.test import TestCase
+
+from core.testing import AdminQueriesMixin
+from .models import IngredientModel
+
+
+class AdminQueriesTest(AdminQueriesMixin, TestCase):
+    def create_rows(self, count):
+        start, self.created = self.created, self.created + count
+        IngredientModel.objects.bulk_create(
+            IngredientModel(name=f"Соль {number}", measurement_unit="г")
+            for number in range(start, self.created)
+        )
+
+    def test_ingredient_changelist(self):
+        self.assertChangelistScales(IngredientModel)
+
+    def test_ingredient_search(self):
+        self.assertChangelistScales(IngredientModel, "?q=соль")
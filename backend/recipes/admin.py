@@ -1,27 +1,99 @@
+from django import forms
 from django.contrib import admin
-from .models import FavoriteDish, ComponentRecipe, Dish, ShoppingCart, ShortUrl
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Q
+from core.pagination import CountingPaginator
+from .models import (
+    FavoriteDish,
+    ComponentRecipe,
+    Dish,
+    ShoppingCart,
+    ShortLinkStat,
+    ShortUrl,
+)
+from .search import RecipeSearch
+
+
+class ListAdmin(admin.ModelAdmin):
+    # Counts are cached (or estimated) and the unfiltered total is not shown,
+    # so a changelist page costs no full COUNT(*) over large tables.
+    paginator = CountingPaginator
+    show_full_result_count = False
+
+
+class LoadedAutocompleteSelect(AutocompleteSelect):
+    # AutocompleteSelect looks the selected object up again for every row;
+    # an object already loaded by the form is rendered as it is.
+    selected = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = self.selected
+        if selected is None or [str(item) for item in value] != [
+            str(selected.pk)
+        ]:
+            return super().optgroups(name, value, attr)
+        options = (
+            []
+            if self.is_required
+            else [self.create_option(name, "", "", False, 0)]
+        )
+        options.append(
+            self.create_option(
+                name,
+                selected.pk,
+                self.choices.field.label_from_instance(selected),
+                True,
+                len(options),
+            )
+        )
+        return [(None, options, 0)]
+
+
+class ComponentRecipeForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.ingredient_id:
+            widget = self.fields["ingredient"].widget
+            getattr(widget, "widget", widget).selected = (
+                self.instance.ingredient
+            )
 
 
 class ComponentRecipeInline(admin.StackedInline):
     model = ComponentRecipe
+    form = ComponentRecipeForm
     extra = 0
+    autocomplete_fields = ("ingredient",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("ingredient")
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "ingredient":
+            kwargs["widget"] = LoadedAutocompleteSelect(
+                db_field, self.admin_site, using=kwargs.get("using")
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 @admin.register(ComponentRecipe)
-class ComponentRecipeAdmin(admin.ModelAdmin):
+class ComponentRecipeAdmin(ListAdmin):
     list_display = (
         "recipe",
         "ingredient",
         "amount",
     )
-    search_fields = ("recipe__name", "ingredient__name")
-    list_filter = ("amount",)
+    list_select_related = ("recipe", "ingredient")
+    autocomplete_fields = ("recipe", "ingredient")
+    search_fields = ("^recipe__name", "^ingredient__name")
 
 
 @admin.register(Dish)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(ListAdmin):
     list_display = ("name", "author", "created_at", "favorites_count")
+    list_select_related = ("author",)
     readonly_fields = ("favorites_count",)
+    autocomplete_fields = ("author",)
     search_fields = (
         "author__username",
         "name",
@@ -30,31 +102,52 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ("created_at",)
     inlines = (ComponentRecipeInline,)
 
-    @admin.display(description="Добавим в избранное")
-    def favorites_count(self, obj):
-        return obj.favorites.count()
+    def get_search_results(self, request, queryset, search_term):
+        # Goes through the full-text index instead of LIKE '%...%' scans.
+        if not search_term:
+            return queryset, False
+        return (
+            queryset.filter(
+                RecipeSearch.condition(queryset, search_term)
+                | Q(author__username=search_term)
+            ),
+            False,
+        )
 
 
 @admin.register(FavoriteDish)
-class FavoriteRecipeAdmin(admin.ModelAdmin):
+class FavoriteRecipeAdmin(ListAdmin):
     list_display = (
         "recipe",
         "user",
+        "created_at",
     )
-    search_fields = ("recipe__name", "user__username")
+    list_select_related = ("recipe", "user")
+    autocomplete_fields = ("recipe", "user")
+    search_fields = ("^recipe__name", "^user__username")
 
 
 @admin.register(ShortUrl)
-class ShortUrlAdmin(admin.ModelAdmin):
+class ShortUrlAdmin(ListAdmin):
     list_display = ("origin_url", "short_url")
     search_fields = ("origin_url", "short_url")
     list_per_page = 20
 
 
+@admin.register(ShortLinkStat)
+class ShortLinkStatAdmin(ListAdmin):
+    list_display = ("token", "hits", "last_hit_at")
+    search_fields = ("token",)
+    readonly_fields = ("token", "hits", "last_hit_at")
+
+
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(ListAdmin):
     list_display = (
         "recipe",
         "user",
+        "created_at",
     )
-    search_fields = ("recipe__name", "user__username")
+    list_select_related = ("recipe", "user")
+    autocomplete_fields = ("recipe", "user")
+    search_fields = ("^recipe__name", "^user__username")
@@ -0,0 +1,202 @@
+import heapq
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Max
+from api.jobs import FeedWorkerPool
+from core.pagination import CustomPagePaginator
+from users.models import SubscriptionPlan
+from .models import Dish, FeedEntry
+
+User = get_user_model()
+
+
+class FeedTimeline:
+    # Hybrid fan-out: recipes of ordinary authors are copied into every
+    # follower's FeedEntry rows when published, recipes of authors with more
+    # than FEED_FANOUT_LIMIT followers (feed_pulled) are read from Dish when
+    # the feed is opened. Both streams are walked with the same
+    # (created_at, id) keyset and merged, so a page never needs more than
+    # two index range scans. Switching an author between the modes moves
+    # rows in FeedWorkerPool, outside the follow or unfollow request.
+
+    ordering = ("-created_at", "-id")
+    entry_ordering = ("-created_at", "-recipe")
+
+    @staticmethod
+    def fields():
+        return [Dish._meta.get_field("created_at"), Dish._meta.get_field("id")]
+
+    @staticmethod
+    def push(author_id, followers, recipes):
+        FeedEntry.objects.bulk_create(
+            (
+                FeedEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    created_at=created_at,
+                )
+                for user_id in followers
+                for recipe_id, created_at in recipes
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def schedule(task, author_id):
+        # A rejected job leaves the author pulled, which reads correctly;
+        # rebuild_feed settles such authors on the next deploy.
+        transaction.on_commit(lambda: FeedWorkerPool.submit(task, author_id))
+
+    @classmethod
+    def publish(cls, dish):
+        author = User.objects.only("feed_pulled").get(pk=dish.author_id)
+        if author.feed_pulled:
+            return
+        followers = SubscriptionPlan.objects.filter(author=author).values_list(
+            "user_id", flat=True
+        )
+        cls.push(author.pk, followers.iterator(), [(dish.pk, dish.created_at)])
+
+    @classmethod
+    def follow(cls, user_id, author_id):
+        User.objects.filter(pk=author_id).update(
+            followers_count=F("followers_count") + 1
+        )
+        author = User.objects.only("followers_count", "feed_pulled").get(
+            pk=author_id
+        )
+        if author.feed_pulled:
+            return
+        if author.followers_count > settings.FEED_FANOUT_LIMIT:
+            User.objects.filter(pk=author_id).update(feed_pulled=True)
+            cls.schedule(cls.retract, author_id)
+            return
+        recipes = Dish.objects.filter(author=author_id).values_list(
+            "pk", "created_at"
+        )
+        cls.push(author_id, [user_id], list(recipes))
+
+    @classmethod
+    def unfollow(cls, user_id, author_id):
+        User.objects.filter(pk=author_id).update(
+            followers_count=F("followers_count") - 1
+        )
+        FeedEntry.objects.filter(user=user_id, author=author_id).delete()
+        if User.objects.filter(
+            pk=author_id,
+            feed_pulled=True,
+            followers_count__lte=settings.FEED_PUSH_LIMIT,
+        ).exists():
+            cls.schedule(cls.restore, author_id)
+
+    @classmethod
+    def retract(cls, author_id, batch_size=1000):
+        # Rows pushed before the author was pulled are skipped by fetch and
+        # removed here in batches.
+        entries = FeedEntry.objects.filter(author=author_id)
+        while User.objects.filter(pk=author_id, feed_pulled=True).exists():
+            batch = list(entries.values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                return
+            FeedEntry.objects.filter(pk__in=batch).delete()
+
+    @classmethod
+    def restore(cls, author_id):
+        # Nothing was pushed while the author was pulled, so their recipes
+        # are pushed to every follower before the author is switched back.
+        # Followers and recipes added meanwhile are pushed once more after
+        # the switch, later ones are pushed by follow and publish.
+        if not User.objects.filter(
+            pk=author_id,
+            feed_pulled=True,
+            followers_count__lte=settings.FEED_PUSH_LIMIT,
+        ).exists():
+            return
+        followers = SubscriptionPlan.objects.filter(author=author_id)
+        recipes = Dish.objects.filter(author=author_id)
+        last_follower = followers.aggregate(last=Max("pk"))["last"] or 0
+        last_recipe = recipes.aggregate(last=Max("pk"))["last"] or 0
+        cls.push_all(author_id, followers, recipes)
+        User.objects.filter(pk=author_id).update(feed_pulled=False)
+        cls.push_all(
+            author_id, followers.filter(pk__gt=last_follower), recipes
+        )
+        cls.push_all(author_id, followers, recipes.filter(pk__gt=last_recipe))
+
+    @classmethod
+    def push_all(cls, author_id, followers, recipes):
+        cls.push(
+            author_id,
+            followers.values_list("user_id", flat=True).iterator(),
+            list(recipes.values_list("pk", "created_at")),
+        )
+
+    @classmethod
+    def rebuild(cls):
+        User.objects.filter(
+            followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).update(feed_pulled=True)
+        User.objects.filter(
+            followers_count__lte=settings.FEED_PUSH_LIMIT
+        ).update(feed_pulled=False)
+        FeedEntry.objects.all().delete()
+        authors = User.objects.filter(
+            followers_count__gt=0, feed_pulled=False
+        ).values_list("pk", flat=True)
+        for author_id in authors.iterator():
+            cls.push_all(
+                author_id,
+                SubscriptionPlan.objects.filter(author=author_id),
+                Dish.objects.filter(author=author_id),
+            )
+        return FeedEntry.objects.count()
+
+    @classmethod
+    def fetch(cls, user, queryset, position, limit, reverse):
+        pulled = list(
+            User.objects.filter(
+                subscribers__user=user, feed_pulled=True
+            ).values_list("pk", flat=True)
+        )
+        fields = cls.fields()
+        entry_fields = [
+            FeedEntry._meta.get_field("created_at"),
+            FeedEntry._meta.get_field("recipe"),
+        ]
+        entry_ordering = CustomPagePaginator.directed(
+            cls.entry_ordering, reverse
+        )
+        entries = (
+            FeedEntry.objects.filter(user=user)
+            .exclude(author__in=pulled)
+            .order_by(*entry_ordering)
+        )
+        if position is not None:
+            entries = entries.filter(
+                CustomPagePaginator.after(
+                    entry_ordering, entry_fields, position
+                )
+            )
+        streams = [
+            list(entries.values_list("created_at", "recipe_id")[:limit])
+        ]
+        if pulled:
+            ordering = CustomPagePaginator.directed(cls.ordering, reverse)
+            recipes = Dish.objects.filter(author__in=pulled).order_by(
+                *ordering
+            )
+            if position is not None:
+                recipes = recipes.filter(
+                    CustomPagePaginator.after(ordering, fields, position)
+                )
+            streams.append(
+                list(recipes.values_list("created_at", "pk")[:limit])
+            )
+        merged = heapq.merge(*streams, reverse=not reverse)
+        ids = [recipe_id for _, recipe_id in merged][:limit]
+        dishes = queryset.in_bulk(ids)
+        return [dishes[pk] for pk in ids if pk in dishes]
@@ -0,0 +1,124 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from django.conf import settings
+from .models import ComponentRecipe
+
+
+class RecipeIngredientIndex:
+    # Inverted index: ingredient id -> sorted ids of the recipes using it, plus
+    # the ingredient set of every recipe for the "only these" query.
+    ALL = "all"
+    ANY = "any"
+    SUBSET = "subset"
+    MATCH_CHOICES = ((ALL, ALL), (ANY, ANY), (SUBSET, SUBSET))
+
+    _postings = {}
+    _recipes = {}
+    _built_at = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def invalidate(cls):
+        cls._built_at = None
+
+    @classmethod
+    def rebuild(cls):
+        postings = defaultdict(list)
+        recipes = defaultdict(set)
+        rows = ComponentRecipe.objects.order_by("ingredient_id", "recipe_id")
+        for ingredient_id, recipe_id in rows.values_list(
+            "ingredient_id", "recipe_id"
+        ).iterator(chunk_size=10000):
+            postings[ingredient_id].append(recipe_id)
+            recipes[recipe_id].add(ingredient_id)
+        with cls._lock:
+            cls._postings = dict(postings)
+            cls._recipes = dict(recipes)
+            cls._built_at = time.monotonic()
+
+    @classmethod
+    def ensure_fresh(cls):
+        # Signals only reach this process, so other workers rely on the TTL.
+        built_at = cls._built_at
+        if built_at is None or (
+            time.monotonic() - built_at > settings.RECIPE_INGREDIENT_INDEX_TTL
+        ):
+            cls.rebuild()
+
+    @classmethod
+    def add(cls, recipe_id, ingredient_id):
+        with cls._lock:
+            if cls._built_at is None:
+                return
+            ingredients = cls._recipes.setdefault(recipe_id, set())
+            if ingredient_id not in ingredients:
+                ingredients.add(ingredient_id)
+                insort(cls._postings.setdefault(ingredient_id, []), recipe_id)
+
+    @classmethod
+    def discard(cls, recipe_id, ingredient_id):
+        with cls._lock:
+            if cls._built_at is None:
+                return
+            ingredients = cls._recipes.get(recipe_id, set())
+            if ingredient_id not in ingredients:
+                return
+            ingredients.discard(ingredient_id)
+            if not ingredients:
+                del cls._recipes[recipe_id]
+            posting = cls._postings[ingredient_id]
+            del posting[bisect_left(posting, recipe_id)]
+            if not posting:
+                del cls._postings[ingredient_id]
+
+    @classmethod
+    def replace(cls, recipe_id, ingredient_ids):
+        with cls._lock:
+            for ingredient_id in cls._recipes.get(recipe_id, set()).copy():
+                cls.discard(recipe_id, ingredient_id)
+            for ingredient_id in ingredient_ids:
+                cls.add(recipe_id, ingredient_id)
+
+    @classmethod
+    def ingredients_of(cls, recipe_id):
+        cls.ensure_fresh()
+        with cls._lock:
+            return frozenset(cls._recipes.get(recipe_id, ()))
+
+    @classmethod
+    def match(cls, ingredient_ids, mode=ALL):
+        cls.ensure_fresh()
+        wanted = set(ingredient_ids)
+        with cls._lock:
+            postings = sorted(
+                (cls._postings.get(pk, []) for pk in wanted), key=len
+            )
+            if not postings:
+                return []
+            if mode == cls.ALL:
+                # Walk the shortest list and probe the longer ones with bisect.
+                result = postings[0]
+                for posting in postings[1:]:
+                    result = [
+                        recipe_id
+                        for recipe_id in result
+                        if cls._contains(posting, recipe_id)
+                    ]
+                    if not result:
+                        break
+                return list(result)
+            candidates = sorted(set().union(*postings))
+            if mode == cls.SUBSET:
+                return [
+                    recipe_id
+                    for recipe_id in candidates
+                    if cls._recipes[recipe_id] <= wanted
+                ]
+            return candidates
+
+    @staticmethod
+    def _contains(posting, recipe_id):
+        index = bisect_left(posting, recipe_id)
+        return index < len(posting) and posting[index] == recipe_id
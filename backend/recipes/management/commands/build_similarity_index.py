@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import RecipeSimilarityIndex
+
+
+class Command(BaseCommand):
+    help = "Строит матрицу рецепт x ингредиент для поиска похожих рецептов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=settings.SIMILARITY_INDEX_PATH)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        matrix = RecipeSimilarityIndex.rebuild(options["path"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Рецептов: {len(matrix['ids'])}, "
+                f"ингредиентов: {len(matrix['columns'])}, "
+                f"связей: {len(matrix['indices'])} "
+                f"за {elapsed:.2f} с -> {options['path']}"
+            )
+        )
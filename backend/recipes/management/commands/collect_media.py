@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.media import MediaReferences
+
+
+class Command(BaseCommand):
+    help = "Удаляет фото и аватары, на которые больше не ссылаются"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Пересчитать ссылки и проверить все файлы в папках медиа",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Только посчитать файлы"
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        removed = MediaReferences.collect(
+            full=options["full"], dry_run=options["dry_run"]
+        )
+        elapsed = time.perf_counter() - started
+        action = "К удалению" if options["dry_run"] else "Удалено"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} файлов: {removed} за {elapsed:.2f} с"
+            )
+        )
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import FeedTimeline
+
+
+class Command(BaseCommand):
+    help = "Заново раскладывает рецепты по лентам подписчиков"
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = FeedTimeline.rebuild()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Записей ленты: {total} за {elapsed:.2f} с")
+        )
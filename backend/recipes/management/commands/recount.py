@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from recipes.models import Dish, FavoriteDish
+from users.models import SubscriptionPlan
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики избранного, рецептов и подписчиков"
+
+    @staticmethod
+    def actual(model, field):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(**{field: OuterRef("pk")})
+                .order_by()
+                .values(field)
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            Value(0),
+        )
+
+    def repair(self, queryset, counter, model, field):
+        # Only rows that drifted are rewritten, each with one UPDATE.
+        actual = self.actual(model, field)
+        drifted = queryset.annotate(actual=actual).exclude(
+            **{counter: F("actual")}
+        )
+        return queryset.filter(pk__in=drifted.values("pk")).update(
+            **{counter: actual}
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = self.repair(
+            Dish.objects.all(), "favorites_count", FavoriteDish, "recipe"
+        )
+        authors = self.repair(
+            User.objects.all(), "recipes_count", Dish, "author"
+        )
+        followed = self.repair(
+            User.objects.all(), "followers_count", SubscriptionPlan, "author"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Исправлено рецептов: {recipes}, авторов: {authors}, "
+                f"подписок: {followed}"
+            )
+        )
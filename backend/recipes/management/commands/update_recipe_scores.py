@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.ranking import RecipeRanking
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает таблицу рейтингов рецептов (popular и trending)"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = RecipeRanking.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Рейтингов: {total} за {time.perf_counter() - started:.2f} с"
+            )
+        )
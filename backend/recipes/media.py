@@ -0,0 +1,152 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+from .models import Dish, MediaFile
+
+User = get_user_model()
+
+
+class MediaReferences:
+    # Reference counts of stored files across recipe photos, avatars and
+    # their variants. Counts only ever mark files as unused; the files are
+    # removed by `collect_media` after MEDIA_GC_GRACE, so an upload that is
+    # saved but not yet referenced by its row is never swept.
+
+    FIELDS = ((Dish, "image"), (User, "avatar"))
+
+    @staticmethod
+    def field_of(model):
+        for media_model, field in MediaReferences.FIELDS:
+            if issubclass(model, media_model):
+                return field
+        return None
+
+    @staticmethod
+    def names(instance, field):
+        field_file = getattr(instance, field)
+        variants = getattr(instance, f"{field}_variants", None) or {}
+        names = set(variants.values())
+        if field_file:
+            names.add(field_file.name)
+        return names
+
+    @classmethod
+    def stored_names(cls, instance, field):
+        if instance._state.adding or instance.pk is None:
+            return set()
+        stored = type(instance).objects.filter(pk=instance.pk)
+        stored = stored.only(field, f"{field}_variants").first()
+        return cls.names(stored, field) if stored else set()
+
+    @staticmethod
+    def adjust(names, delta):
+        if not names:
+            return
+        MediaFile.objects.bulk_create(
+            [MediaFile(name=name) for name in names], ignore_conflicts=True
+        )
+        MediaFile.objects.filter(name__in=names).update(
+            references=F("references") + delta, updated_at=timezone.now()
+        )
+
+    @classmethod
+    def replace(cls, old, new):
+        cls.adjust(new - old, 1)
+        cls.adjust(old - new, -1)
+
+    @classmethod
+    def count(cls):
+        counts = Counter()
+        for model, field in cls.FIELDS:
+            rows = model.objects.exclude(**{field: ""}).exclude(
+                **{field: None}
+            )
+            for name, variants in rows.values_list(
+                field, f"{field}_variants"
+            ).iterator(chunk_size=10000):
+                counts.update({name, *(variants or {}).values()})
+        return counts
+
+    @classmethod
+    def recount(cls):
+        # Rewrites drifted counts from the tables and returns the real ones.
+        counts = cls.count()
+        stored = dict(MediaFile.objects.values_list("name", "references"))
+        now = timezone.now()
+        MediaFile.objects.bulk_create(
+            [
+                MediaFile(name=name, references=references, updated_at=now)
+                for name, references in counts.items()
+                if stored.get(name) != references
+            ],
+            update_conflicts=True,
+            unique_fields=("name",),
+            update_fields=("references", "updated_at"),
+            batch_size=1000,
+        )
+        MediaFile.objects.filter(references__gt=0).exclude(
+            name__in=counts.keys()
+        ).update(references=0, updated_at=now)
+        return counts
+
+    @staticmethod
+    def directories():
+        return {
+            settings.CONTENT_STORAGE_PREFIX,
+            settings.UPLOAD_RECIPES,
+            settings.UPLOAD_AVATAR,
+        }
+
+    @classmethod
+    def stored_files(cls, storage=default_storage):
+        pending = list(cls.directories())
+        while pending:
+            directory = pending.pop()
+            if not storage.exists(directory):
+                continue
+            subdirectories, files = storage.listdir(directory)
+            pending.extend(
+                os.path.join(directory, subdirectory, "")
+                for subdirectory in subdirectories
+            )
+            for name in files:
+                yield os.path.join(directory, name)
+
+    @classmethod
+    def collect(cls, full=False, dry_run=False, storage=default_storage):
+        # Without `full` only files whose count dropped to zero are checked;
+        # `full` recounts from the tables and also walks the media folders
+        # for files that were never counted.
+        deadline = timezone.now() - timedelta(seconds=settings.MEDIA_GC_GRACE)
+        unused = MediaFile.objects.filter(
+            references__lte=0, updated_at__lt=deadline
+        )
+        candidates = set(unused.values_list("name", flat=True))
+        if full:
+            referenced = cls.recount()
+            candidates.update(
+                name
+                for name in cls.stored_files(storage)
+                if name not in referenced
+            )
+        removed = 0
+        for name in sorted(candidates):
+            exists = storage.exists(name)
+            if exists and storage.get_modified_time(name) >= deadline:
+                continue
+            if dry_run:
+                removed += exists
+                continue
+            # The row is dropped only while still unused, so a file that was
+            # referenced again in the meantime is kept.
+            MediaFile.objects.filter(name=name, references__lte=0).delete()
+            if exists and not MediaFile.objects.filter(name=name).exists():
+                storage.delete(name)
+                removed += 1
+        return removed
@@ -1,6 +1,10 @@
+import uuid
 from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from core.counters import CounterFieldsMixin
+from django.utils import timezone
 from foodgram.const import (
     max_len_recipe,
     max_len_url,
@@ -16,7 +20,57 @@ from .utils import generate_short_token
 User = get_user_model()
 
 
-class Dish(models.Model):
+class DishQuerySet(models.QuerySet):
+    def published(self):
+        # A recipe gets its photo from the image job. Until then, or for good
+        # when its first photo failed, only its author sees it.
+        return self.exclude(image="")
+
+    def visible_to(self, user):
+        if user is None or user.is_anonymous:
+            return self.published()
+        return self.filter(~models.Q(image="") | models.Q(author=user))
+
+    def with_user_flags(self, user):
+        if user is None or user.is_anonymous:
+            queryset = self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        else:
+            queryset = self.annotate(
+                is_favorited=models.Exists(
+                    FavoriteDish.objects.filter(
+                        user=user, recipe=models.OuterRef("pk")
+                    )
+                ),
+                is_in_shopping_cart=models.Exists(
+                    ShoppingCart.objects.filter(
+                        user=user, recipe=models.OuterRef("pk")
+                    )
+                ),
+            )
+        return queryset.prefetch_related(
+            models.Prefetch(
+                "author", queryset=User.objects.with_is_subscribed(user)
+            ),
+            models.Prefetch(
+                "ingredient_recipes",
+                queryset=ComponentRecipe.objects.select_related("ingredient"),
+            ),
+        )
+
+
+class Dish(CounterFieldsMixin, models.Model):
+    class ImageStatus(models.TextChoices):
+        READY = "ready", "Готово"
+        PENDING = "pending", "Обрабатывается"
+        FAILED = "failed", "Ошибка"
+
     name = models.CharField(
         verbose_name="Название вашего шедевра",
         max_length=max_len_recipe,
@@ -41,6 +95,16 @@ class Dish(models.Model):
         verbose_name="Фото",
         upload_to=getattr(settings, "UPLOAD_RECIPES", "recipes/images/"),
     )
+    image_variants = models.JSONField(
+        verbose_name="Варианты фото", default=dict, blank=True, editable=False
+    )
+    image_status = models.CharField(
+        verbose_name="Состояние фото",
+        max_length=16,
+        choices=ImageStatus.choices,
+        default=ImageStatus.READY,
+        editable=False,
+    )
     ingredients = models.ManyToManyField(
         to=IngredientModel,
         verbose_name="Ингредиенты",
@@ -51,16 +115,25 @@ class Dish(models.Model):
         to=User,
         on_delete=models.CASCADE,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="Добавлений в избранное", default=0, editable=False
+    )
     created_at = models.DateTimeField(verbose_name="Добавлено", auto_now_add=True)
+    updated_at = models.DateTimeField(verbose_name="Изменено", auto_now=True)
+
+    objects = DishQuerySet.as_manager()
+    counter_fields = ("favorites_count",)
 
     class Meta:
         default_related_name = "recipes"
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ("-created_at",)
-
-    def __str__(self):
-        return self.name
+        indexes = (
+            models.Index(
+                fields=("-created_at", "-id"), name="recipe_created_id_idx"
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -101,6 +174,9 @@ class FavoriteDish(models.Model):
         to=User,
         on_delete=models.CASCADE,
     )
+    created_at = models.DateTimeField(
+        verbose_name="Добавлено", default=timezone.now
+    )
 
     class Meta:
         default_related_name = "favorites"
@@ -118,6 +194,9 @@ class ShoppingCart(models.Model):
         to=User,
         on_delete=models.CASCADE,
     )
+    created_at = models.DateTimeField(
+        verbose_name="Добавлено", default=timezone.now
+    )
 
     class Meta:
         default_related_name = "shopping_cart"
@@ -128,6 +207,80 @@ class ShoppingCart(models.Model):
         return str(self.recipe)
 
 
+class RecipeScore(models.Model):
+    # Materialized ranking, written in batches by recipes.ranking.
+    recipe = models.OneToOneField(
+        verbose_name="Рецепт",
+        to=Dish,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="score",
+    )
+    popular = models.PositiveIntegerField(
+        verbose_name="Популярность", default=0
+    )
+    trending = models.FloatField(verbose_name="Тренд", null=True, blank=True)
+    computed_at = models.DateTimeField(
+        verbose_name="Пересчитано", auto_now=True
+    )
+
+    class Meta:
+        verbose_name = "Рейтинг рецепта"
+        verbose_name_plural = "Рейтинги рецептов"
+        indexes = (
+            models.Index(
+                fields=("-popular",), name="recipe_score_popular_idx"
+            ),
+            models.Index(
+                fields=("-trending",), name="recipe_score_trending_idx"
+            ),
+        )
+
+    def __str__(self):
+        return f"{self.recipe_id}: {self.popular}"
+
+
+class FeedEntry(models.Model):
+    # Recipe pushed into a follower's timeline, see recipes.feed.
+    user = models.ForeignKey(
+        verbose_name="Подписчик",
+        to=User,
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey(
+        verbose_name="Рецепт", to=Dish, on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        verbose_name="Автор",
+        to=User,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    created_at = models.DateTimeField(verbose_name="Опубликовано")
+
+    class Meta:
+        default_related_name = "feed_entries"
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи ленты"
+        constraints = (
+            models.UniqueConstraint(
+                fields=("user", "recipe"), name="unique_feed_entry"
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=("user", "-created_at", "-recipe"),
+                name="feed_user_created_idx",
+            ),
+            models.Index(
+                fields=("user", "author"), name="feed_user_author_idx"
+            ),
+        )
+
+    def __str__(self):
+        return f"{self.user}: {self.recipe_id}"
+
+
 class ShortUrl(models.Model):
     origin_url = models.URLField(
         verbose_name="Исходная ссылка", primary_key=True, max_length=200
@@ -153,3 +306,129 @@ class ShortUrl(models.Model):
                 self.__class__
             )  # Pass the ShortUrl class
         super().save(*args, **kwargs)
+
+
+class ShortLinkStat(models.Model):
+    token = models.SlugField(
+        verbose_name="Короткая ссылка",
+        max_length=max_len_url,
+        unique=True,
+    )
+    hits = models.PositiveBigIntegerField(verbose_name="Переходы", default=0)
+    last_hit_at = models.DateTimeField(
+        verbose_name="Последний переход", null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = "Статистика короткой ссылки"
+        verbose_name_plural = "Статистика коротких ссылок"
+        ordering = ("-hits",)
+
+    def __str__(self):
+        return f"{self.token}: {self.hits}"
+
+
+def export_storage():
+    return FileSystemStorage(location=settings.EXPORTS_ROOT)
+
+
+class ExportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending", "В очереди"
+        RUNNING = "running", "Формируется"
+        DONE = "done", "Готово"
+        FAILED = "failed", "Ошибка"
+
+    class Format(models.TextChoices):
+        PDF = "pdf", "PDF"
+        TXT = "txt", "Текст"
+        CSV = "csv", "CSV"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        verbose_name="Кулинар",
+        to=User,
+        on_delete=models.CASCADE,
+    )
+    export_format = models.CharField(
+        verbose_name="Формат",
+        max_length=3,
+        choices=Format.choices,
+        default=Format.PDF,
+    )
+    status = models.CharField(
+        verbose_name="Статус",
+        max_length=16,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    file = models.FileField(
+        verbose_name="Файл", storage=export_storage, blank=True
+    )
+    error = models.TextField(verbose_name="Ошибка", blank=True)
+    created_at = models.DateTimeField(
+        verbose_name="Создано", auto_now_add=True
+    )
+    finished_at = models.DateTimeField(
+        verbose_name="Готово", null=True, blank=True
+    )
+
+    class Meta:
+        default_related_name = "export_jobs"
+        verbose_name = "Выгрузка списка покупок"
+        verbose_name_plural = "Выгрузки списков покупок"
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.user} ({self.export_format}, {self.status})"
+
+
+def upload_storage():
+    return FileSystemStorage(location=settings.IMAGE_UPLOADS_ROOT)
+
+
+class ImageJob(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    recipe = models.ForeignKey(
+        verbose_name="Рецепт",
+        to=Dish,
+        on_delete=models.CASCADE,
+    )
+    payload = models.FileField(verbose_name="Данные", storage=upload_storage)
+    created_at = models.DateTimeField(
+        verbose_name="Создано", default=timezone.now
+    )
+    started_at = models.DateTimeField(
+        verbose_name="Начато", null=True, blank=True
+    )
+
+    class Meta:
+        default_related_name = "image_jobs"
+        verbose_name = "Обработка фото"
+        verbose_name_plural = "Обработка фото"
+        ordering = ("created_at",)
+
+    def __str__(self):
+        return f"{self.recipe_id} ({self.created_at})"
+
+
+class MediaFile(models.Model):
+    name = models.CharField(
+        verbose_name="Файл", max_length=255, primary_key=True
+    )
+    references = models.IntegerField(verbose_name="Ссылок", default=0)
+    updated_at = models.DateTimeField(
+        verbose_name="Изменено", default=timezone.now
+    )
+
+    class Meta:
+        verbose_name = "Медиафайл"
+        verbose_name_plural = "Медиафайлы"
+        indexes = (
+            models.Index(
+                fields=("references", "updated_at"), name="media_refs_idx"
+            ),
+        )
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
@@ -0,0 +1,134 @@
+import atexit
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from .models import Dish, FavoriteDish, RecipeScore, ShoppingCart
+
+# Trending uses forward decay: every favorite or cart add weighs
+# exp(rate * (t - EPOCH)) and the score is the log of their sum. Ordering
+# by it equals ordering by activity decayed to "now", yet old scores never
+# need to be decayed again, so only recipes with new activity are rewritten.
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc).timestamp()
+SOURCES = (FavoriteDish, ShoppingCart)
+ORDERINGS = {
+    "popular": (
+        F("score__popular").desc(nulls_last=True),
+        "-created_at",
+        "-id",
+    ),
+    "trending": (
+        F("score__trending").desc(nulls_last=True),
+        "-created_at",
+        "-id",
+    ),
+}
+
+
+def log_add_exp(left, right):
+    if left < right:
+        left, right = right, left
+    if right == -math.inf:
+        return left
+    return left + math.log1p(math.exp(right - left))
+
+
+class RecipeRanking:
+    _dirty = set()
+    _lock = threading.Lock()
+    _flushed_at = time.monotonic()
+
+    @staticmethod
+    def decay_rate():
+        return math.log(2) / (settings.TRENDING_HALF_LIFE_HOURS * 60 * 60)
+
+    @classmethod
+    def order(cls, queryset, ordering):
+        return queryset.order_by(*ORDERINGS[ordering])
+
+    @classmethod
+    def record(cls, recipe_id):
+        with cls._lock:
+            cls._dirty.add(recipe_id)
+            due = (
+                len(cls._dirty) >= settings.RANKING_ACTIVITY_THRESHOLD
+                or time.monotonic() - cls._flushed_at
+                >= settings.RANKING_FLUSH_INTERVAL
+            )
+        if due:
+            try:
+                cls.flush()
+            except DatabaseError:
+                # The ids are queued again and go out with the next batch
+                pass
+
+    @classmethod
+    def flush(cls):
+        with cls._lock:
+            dirty, cls._dirty = cls._dirty, set()
+            cls._flushed_at = time.monotonic()
+        if not dirty:
+            return
+        try:
+            cls.recompute(dirty)
+        except DatabaseError:
+            with cls._lock:
+                cls._dirty |= dirty
+            raise
+
+    @classmethod
+    def compute(cls, recipe_ids=None):
+        rate = cls.decay_rate()
+        popular = Counter()
+        trending = defaultdict(lambda: -math.inf)
+        for model in SOURCES:
+            rows = model.objects.all()
+            if recipe_ids is not None:
+                rows = rows.filter(recipe__in=recipe_ids)
+            for recipe_id, created_at in rows.values_list(
+                "recipe_id", "created_at"
+            ).iterator(chunk_size=10000):
+                popular[recipe_id] += 1
+                trending[recipe_id] = log_add_exp(
+                    trending[recipe_id],
+                    rate * (created_at.timestamp() - EPOCH),
+                )
+        return [
+            RecipeScore(
+                recipe_id=recipe_id,
+                popular=popular[recipe_id],
+                trending=trending[recipe_id] if popular[recipe_id] else None,
+            )
+            for recipe_id in (popular if recipe_ids is None else recipe_ids)
+        ]
+
+    @classmethod
+    @transaction.atomic
+    def recompute(cls, recipe_ids):
+        # Recipes deleted since the activity was recorded are skipped.
+        existing = set(
+            Dish.objects.filter(pk__in=recipe_ids).values_list("pk", flat=True)
+        )
+        RecipeScore.objects.bulk_create(
+            cls.compute(existing),
+            update_conflicts=True,
+            unique_fields=("recipe",),
+            update_fields=("popular", "trending", "computed_at"),
+            batch_size=1000,
+        )
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls):
+        scores = cls.compute()
+        RecipeScore.objects.all().delete()
+        RecipeScore.objects.bulk_create(scores, batch_size=1000)
+        return len(scores)
+
+
+atexit.register(RecipeRanking.flush)
@@ -0,0 +1,150 @@
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorExact,
+    SearchVectorField,
+)
+from django.db import connections, models
+from django.db.models.expressions import Col, RawSQL
+
+
+class RecipeSearch:
+    # The full-text index lives next to Dish but outside the ORM: PostgreSQL
+    # keeps a generated tsvector column with a GIN index, SQLite an external
+    # content FTS5 table maintained by triggers. Both are updated by the
+    # database itself on every insert, update and delete of a recipe.
+
+    config = "russian"
+    fts_table = "recipes_dish_fts"
+
+    @classmethod
+    def install(cls, using="default", **kwargs):
+        from .models import Dish
+
+        connection = connections[using]
+        table = Dish._meta.db_table
+        if table not in connection.introspection.table_names():
+            return
+        fts, config = cls.fts_table, cls.config
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    f"ALTER TABLE {table} "
+                    f"ADD COLUMN IF NOT EXISTS search_vector "
+                    f"tsvector GENERATED ALWAYS AS ("
+                    f"setweight(to_tsvector('{config}', coalesce(name, '')),"
+                    f" 'A') || "
+                    f"setweight(to_tsvector('{config}', coalesce(text, '')),"
+                    f" 'B')) STORED"
+                )
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS recipe_search_idx "
+                    f"ON {table} USING GIN (search_vector)"
+                )
+            elif connection.vendor == "sqlite":
+                created = fts not in connection.introspection.table_names()
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"name, text, content='{table}', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2')"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ai "
+                    f"AFTER INSERT ON {table} BEGIN "
+                    f"INSERT INTO {fts}(rowid, name, text) "
+                    f"VALUES (new.id, new.name, new.text); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ad "
+                    f"AFTER DELETE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, name, text) "
+                    f"VALUES ('delete', old.id, old.name, old.text); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_au "
+                    f"AFTER UPDATE OF name, text ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, name, text) "
+                    f"VALUES ('delete', old.id, old.name, old.text); "
+                    f"INSERT INTO {fts}(rowid, name, text) "
+                    f"VALUES (new.id, new.name, new.text); END"
+                )
+                if created:
+                    cursor.execute(
+                        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"
+                    )
+
+    @staticmethod
+    def vector(model):
+        # search_vector is not a model field. A Col keeps its table alias
+        # relabelable, so the condition also works inside subqueries.
+        field = SearchVectorField()
+        field.set_attributes_from_name("search_vector")
+        field.model = model
+        return Col(model._meta.db_table, field)
+
+    @classmethod
+    def expressions(cls, queryset, query):
+        # Returns the match condition and the relevance of a stripped query.
+        vendor = connections[queryset.db].vendor
+        if vendor == "postgresql":
+            vector = cls.vector(queryset.model)
+            tsquery = SearchQuery(
+                query, config=cls.config, search_type="websearch"
+            )
+            return (
+                models.Q(SearchVectorExact(vector, tsquery)),
+                SearchRank(vector, tsquery, cover_density=True),
+            )
+        if vendor == "sqlite":
+            # FTS5 has no Russian stemmer, prefix queries stand in for it.
+            terms = re.findall(r"\w+", query)
+            if not terms:
+                return models.Q(pk__in=()), models.Value(0.0)
+            match = " ".join(f'"{term}"*' for term in terms)
+            condition = models.Q(
+                pk__in=RawSQL(
+                    f"SELECT rowid FROM {cls.fts_table} "
+                    f"WHERE {cls.fts_table} MATCH %s",
+                    (match,),
+                )
+            )
+            # bm25() is lower for better matches; name outweighs the text.
+            # The joiner puts the recipe id after "rowid = ".
+            rank = models.Func(
+                models.Value(match),
+                models.F("pk"),
+                template=(
+                    f"(SELECT -bm25({cls.fts_table}, 10.0, 1.0) "
+                    f"FROM {cls.fts_table} "
+                    f"WHERE {cls.fts_table} MATCH %(expressions)s)"
+                ),
+                arg_joiner=" AND rowid = ",
+                output_field=models.FloatField(),
+            )
+            return condition, rank
+        return (
+            models.Q(name__icontains=query) | models.Q(text__icontains=query),
+            models.Case(
+                models.When(name__icontains=query, then=models.Value(1.0)),
+                default=models.Value(0.0),
+                output_field=models.FloatField(),
+            ),
+        )
+
+    @classmethod
+    def condition(cls, queryset, query):
+        return cls.expressions(queryset, query.strip())[0]
+
+    @classmethod
+    def filter(cls, queryset, query):
+        query = query.strip()
+        if not query:
+            return queryset
+        condition, rank = cls.expressions(queryset, query)
+        return (
+            queryset.filter(condition)
+            .annotate(search_rank=rank)
+            .order_by("-search_rank", "-created_at", "-id")
+        )
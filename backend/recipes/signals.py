@@ -0,0 +1,190 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+from api.jobs import ImageWorkerPool
+from core.images import ImageVariants
+from core.pagination import CountCache
+from ingredients.models import IngredientModel
+from users.models import BlogerUser, SubscriptionPlan
+from .feed import FeedTimeline
+from .index import RecipeIngredientIndex
+from .media import MediaReferences
+from .models import (
+    ComponentRecipe,
+    Dish,
+    ExportJob,
+    FavoriteDish,
+    ImageJob,
+    ShoppingCart,
+)
+from .similarity import RecipeSimilarityIndex
+
+
+def touch_recipe(recipe_id):
+    Dish.objects.filter(pk=recipe_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=ComponentRecipe)
+def touch_recipe_on_save(sender, instance, raw, **kwargs):
+    if not raw:
+        touch_recipe(instance.recipe_id)
+
+
+@receiver(post_delete, sender=ComponentRecipe)
+def touch_recipe_on_delete(sender, instance, origin=None, **kwargs):
+    # Bulk deletes come from recipe updates and cascades, which save or
+    # remove the recipe themselves, or from an ingredient delete, which
+    # touches its recipes in touch_recipes_without_ingredient.
+    if origin is instance:
+        touch_recipe(instance.recipe_id)
+
+
+@receiver(post_save, sender=ComponentRecipe)
+def index_component(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: RecipeIngredientIndex.add(
+            instance.recipe_id, instance.ingredient_id
+        )
+    )
+    transaction.on_commit(RecipeSimilarityIndex.mark_stale)
+
+
+@receiver(post_delete, sender=ComponentRecipe)
+def unindex_component(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: RecipeIngredientIndex.discard(
+            instance.recipe_id, instance.ingredient_id
+        )
+    )
+    transaction.on_commit(RecipeSimilarityIndex.mark_stale)
+
+
+@receiver(post_delete, sender=Dish)
+def unindex_recipe(sender, instance, **kwargs):
+    transaction.on_commit(lambda: RecipeSimilarityIndex.forget(instance.pk))
+
+
+@receiver(post_save, sender=IngredientModel)
+def touch_recipes_with_ingredient(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        Dish.objects.filter(ingredients=instance).update(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(pre_delete, sender=IngredientModel)
+def touch_recipes_without_ingredient(sender, instance, **kwargs):
+    # The cascade removes the ComponentRecipe rows right after this.
+    Dish.objects.filter(ingredients=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Dish)
+def count_recipe(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        BlogerUser.objects.filter(pk=instance.author_id).update(
+            recipes_count=F("recipes_count") + 1
+        )
+
+
+@receiver(post_delete, sender=Dish)
+def uncount_recipe(sender, instance, **kwargs):
+    BlogerUser.objects.filter(pk=instance.author_id).update(
+        recipes_count=F("recipes_count") - 1
+    )
+
+
+@receiver(post_save, sender=FavoriteDish)
+def count_favorite(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        Dish.objects.filter(pk=instance.recipe_id).update(
+            favorites_count=F("favorites_count") + 1
+        )
+
+
+@receiver(post_delete, sender=FavoriteDish)
+def uncount_favorite(sender, instance, **kwargs):
+    Dish.objects.filter(pk=instance.recipe_id).update(
+        favorites_count=F("favorites_count") - 1
+    )
+
+
+@receiver((post_save, post_delete), sender=Dish)
+@receiver((post_save, post_delete), sender=FavoriteDish)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=BlogerUser)
+@receiver((post_save, post_delete), sender=SubscriptionPlan)
+def invalidate_list_counts(sender, **kwargs):
+    CountCache.invalidate()
+
+
+@receiver(post_save, sender=Dish)
+def publish_recipe(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: FeedTimeline.publish(instance))
+
+
+@receiver(post_save, sender=SubscriptionPlan)
+def follow_author(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        FeedTimeline.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=SubscriptionPlan)
+def unfollow_author(sender, instance, **kwargs):
+    FeedTimeline.unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=ImageJob)
+def remove_image_payload(sender, instance, **kwargs):
+    transaction.on_commit(lambda: instance.payload.delete(save=False))
+
+
+@receiver(post_delete, sender=ExportJob)
+def remove_export_file(sender, instance, **kwargs):
+    transaction.on_commit(lambda: instance.file.delete(save=False))
+
+
+@receiver(pre_save, sender=Dish)
+@receiver(pre_save, sender=BlogerUser)
+def remember_media(sender, instance, raw, update_fields=None, **kwargs):
+    field = MediaReferences.field_of(sender)
+    if raw or (
+        update_fields is not None
+        and not {field, f"{field}_variants"} & set(update_fields)
+    ):
+        return
+    instance._stored_media = MediaReferences.stored_names(instance, field)
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_save, sender=BlogerUser)
+def count_media(sender, instance, raw, **kwargs):
+    # Uploaded files get their final names while the row is saved, so the
+    # new names are read here. Variants are rendered in the background for
+    # a photo the row did not have before; their save is counted on its own.
+    field = MediaReferences.field_of(sender)
+    stored = instance.__dict__.pop("_stored_media", None)
+    if stored is None:
+        return
+    MediaReferences.replace(stored, MediaReferences.names(instance, field))
+    name = getattr(instance, field).name or ""
+    if name not in stored and ImageVariants.outdated(instance, field):
+        transaction.on_commit(
+            lambda: ImageWorkerPool.submit(
+                ImageVariants.refresh, sender, instance.pk, field
+            )
+        )
+
+
+@receiver(post_delete, sender=Dish)
+@receiver(post_delete, sender=BlogerUser)
+def release_media(sender, instance, **kwargs):
+    field = MediaReferences.field_of(sender)
+    MediaReferences.adjust(MediaReferences.names(instance, field), -1)
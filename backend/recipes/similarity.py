@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .models import ComponentRecipe, Dish
+
+
+class RecipeSimilarityIndex:
+    # Recipe x ingredient incidence matrix kept in both CSR (ingredients of a
+    # recipe) and CSC (recipes of an ingredient) form. The overlap of one
+    # recipe with every other one is a single bincount over the CSC rows of
+    # its ingredients, Jaccard and top-k follow as vector operations.
+    #
+    # Recipes changed after the matrix was built live in a small delta that
+    # overrides their rows until the next full build.
+
+    _matrix = None
+    _delta = {}
+    _synced_at = None
+    _checked_at = None
+    _lock = threading.RLock()
+
+    @staticmethod
+    def build_matrix(recipes):
+        ids = np.array(sorted(recipes), dtype=np.int64)
+        columns = np.array(
+            sorted(set().union(*recipes.values())) if recipes else [],
+            dtype=np.int64,
+        )
+        sizes = np.array([len(recipes[pk]) for pk in ids], dtype=np.int32)
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+        indices = np.searchsorted(
+            columns,
+            np.fromiter(
+                (ing for pk in ids for ing in sorted(recipes[pk])),
+                dtype=np.int64,
+                count=int(indptr[-1]),
+            ),
+        ).astype(np.int32)
+        rows = np.repeat(np.arange(len(ids), dtype=np.int32), sizes)
+        order = np.argsort(indices, kind="stable")
+        col_indptr = np.zeros(len(columns) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(indices, minlength=len(columns)), out=col_indptr[1:]
+        )
+        return {
+            "ids": ids,
+            "columns": columns,
+            "sizes": sizes,
+            "indptr": indptr,
+            "indices": indices,
+            "col_indptr": col_indptr,
+            "col_rows": rows[order],
+        }
+
+    @staticmethod
+    def fetch(queryset=None):
+        recipes = {}
+        rows = ComponentRecipe.objects.all() if queryset is None else queryset
+        for recipe_id, ingredient_id in rows.values_list(
+            "recipe_id", "ingredient_id"
+        ).iterator(chunk_size=10000):
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        return recipes
+
+    @classmethod
+    def rebuild(cls, path=None):
+        synced_at = timezone.now()
+        matrix = cls.build_matrix(cls.fetch())
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as stream:
+                np.savez(stream, built_at=synced_at.timestamp(), **matrix)
+        with cls._lock:
+            cls._matrix = matrix
+            cls._delta = {}
+            cls._synced_at = synced_at
+            cls._checked_at = time.monotonic()
+        return matrix
+
+    @classmethod
+    def load(cls):
+        path = settings.SIMILARITY_INDEX_PATH
+        if not os.path.exists(path):
+            cls.rebuild()
+            return
+        with np.load(path) as stored:
+            matrix = {name: stored[name] for name in stored.files}
+        built_at = matrix.pop("built_at")
+        existing = np.fromiter(
+            Dish.objects.values_list("pk", flat=True).iterator(
+                chunk_size=10000
+            ),
+            dtype=np.int64,
+        )
+        removed = matrix["ids"][~np.isin(matrix["ids"], existing)]
+        with cls._lock:
+            cls._matrix = matrix
+            cls._delta = {int(pk): set() for pk in removed}
+            cls._synced_at = datetime.fromtimestamp(
+                float(built_at), dt_timezone.utc
+            )
+        cls.sync()
+
+    @classmethod
+    def sync(cls):
+        # Recipes touched since the last sync (updated_at follows ingredient
+        # changes too) replace their matrix rows through the delta.
+        synced_at = timezone.now()
+        changed = Dish.objects.filter(updated_at__gte=cls._synced_at).values(
+            "pk"
+        )
+        recipes = cls.fetch(ComponentRecipe.objects.filter(recipe__in=changed))
+        for pk in changed.values_list("pk", flat=True):
+            recipes.setdefault(pk, set())
+        with cls._lock:
+            cls._delta.update(recipes)
+            cls._synced_at = synced_at
+            cls._checked_at = time.monotonic()
+        if len(cls._delta) > settings.SIMILARITY_INDEX_MAX_DELTA:
+            cls.rebuild()
+
+    @classmethod
+    def mark_stale(cls):
+        cls._checked_at = None
+
+    @classmethod
+    def ensure_fresh(cls):
+        if cls._matrix is None:
+            cls.load()
+        elif cls._checked_at is None or (
+            time.monotonic() - cls._checked_at
+            > settings.SIMILARITY_INDEX_REFRESH
+        ):
+            cls.sync()
+
+    @classmethod
+    def forget(cls, recipe_id):
+        with cls._lock:
+            if cls._matrix is not None:
+                cls._delta[recipe_id] = set()
+
+    @staticmethod
+    def positions(values, keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        found = np.searchsorted(values, keys)
+        valid = found < len(values)
+        found, keys = found[valid], keys[valid]
+        return found[values[found] == keys]
+
+    @classmethod
+    def similar(cls, recipe_id, limit):
+        cls.ensure_fresh()
+        with cls._lock:
+            matrix, delta = cls._matrix, dict(cls._delta)
+        ids, columns = matrix["ids"], matrix["columns"]
+        row = cls.positions(ids, [recipe_id])
+        if recipe_id in delta:
+            wanted = delta[recipe_id]
+        elif len(row):
+            start, end = matrix["indptr"][row[0]], matrix["indptr"][row[0] + 1]
+            wanted = set(columns[matrix["indices"][start:end]].tolist())
+        else:
+            rows = ComponentRecipe.objects.filter(recipe=recipe_id)
+            wanted = cls.fetch(rows).get(recipe_id, set())
+        if not wanted:
+            return []
+        ranked = []
+        if len(ids):
+            col_indptr, col_rows = matrix["col_indptr"], matrix["col_rows"]
+            hits = []
+            for col in cls.positions(columns, sorted(wanted)):
+                start, end = col_indptr[col], col_indptr[col + 1]
+                hits.append(col_rows[start:end])
+            overlap = np.bincount(
+                np.concatenate(hits) if hits else np.empty(0, dtype=np.int32),
+                minlength=len(ids),
+            )
+            scores = overlap / (len(wanted) + matrix["sizes"] - overlap)
+            # Rows overridden by the delta are scored from the delta instead.
+            scores[cls.positions(ids, list(delta))] = 0
+            scores[row] = 0
+            # Everything tied with the k-th best score is kept, so ties are
+            # broken by id below rather than by argpartition's choice.
+            kth = min(limit, len(ids)) - 1
+            threshold = max(np.partition(-scores, kth)[kth], -1.0)
+            top = np.flatnonzero((-scores <= threshold) & (scores > 0))
+            ranked = [(float(scores[index]), int(ids[index])) for index in top]
+        for pk, ingredients in delta.items():
+            common = len(wanted & ingredients)
+            if pk != recipe_id and common:
+                ranked.append((common / len(wanted | ingredients), pk))
+        ranked.sort(key=lambda item: (-item[0], -item[1]))
+        return [pk for _, pk in ranked[:limit]]
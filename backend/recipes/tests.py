@@ -0,0 +1,517 @@
+import os
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.jobs import FeedWorkerPool, ImageWorkerPool
+from core.testing import AdminQueriesMixin, BackgroundJobsMixin, create_user
+from ingredients.models import IngredientModel
+from users.models import SubscriptionPlan
+from .utils import decode_short_code, encode_recipe_id
+from .feed import FeedTimeline
+from .index import RecipeIngredientIndex
+from .media import MediaReferences
+from .models import (
+    ComponentRecipe,
+    Dish,
+    FavoriteDish,
+    FeedEntry,
+    MediaFile,
+    ShoppingCart,
+    ShortLinkStat,
+    ShortUrl,
+)
+
+
+class AdminQueriesTest(AdminQueriesMixin, TestCase):
+    # The recipe form must scale like the changelists.
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ingredients = IngredientModel.objects.bulk_create(
+            IngredientModel(name=f"Ингредиент {number}", measurement_unit="г")
+            for number in range(30)
+        )
+
+    def create_rows(self, count):
+        for _ in range(count):
+            self.created += 1
+            author = create_user(f"cook{self.created}")
+            recipe = Dish.objects.create(
+                author=author,
+                name=f"Борщ {self.created}",
+                text="Свёкла, капуста",
+                cooking_time=30,
+                image="recipes/images/borsch.jpg",
+            )
+            ComponentRecipe.objects.bulk_create(
+                ComponentRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in self.ingredients[:3]
+            )
+            FavoriteDish.objects.create(user=author, recipe=recipe)
+            ShoppingCart.objects.create(user=author, recipe=recipe)
+            ShortUrl.objects.create(origin_url=f"/recipes/{recipe.pk}/")
+            ShortLinkStat.objects.create(token=f"token{self.created}", hits=1)
+
+    def test_recipe_changelist(self):
+        self.assertChangelistScales(Dish)
+
+    def test_recipe_search(self):
+        self.assertChangelistScales(Dish, "?q=борщ")
+
+    def test_component_changelist(self):
+        self.assertChangelistScales(ComponentRecipe)
+
+    def test_favorite_changelist(self):
+        self.assertChangelistScales(FavoriteDish)
+
+    def test_shopping_cart_changelist(self):
+        self.assertChangelistScales(ShoppingCart)
+
+    def test_short_url_changelist(self):
+        self.assertChangelistScales(ShortUrl)
+
+    def test_short_link_stat_changelist(self):
+        self.assertChangelistScales(ShortLinkStat)
+
+    def test_recipe_search_matches_name_and_author(self):
+        self.create_rows(3)
+        url = reverse("admin:recipes_dish_changelist")
+        response = self.client.get(url, {"q": "борщ"})
+        self.assertEqual(response.context["cl"].result_count, 3)
+        response = self.client.get(url, {"q": "cook2"})
+        self.assertEqual(
+            [
+                recipe.author.username
+                for recipe in response.context["cl"].result_list
+            ],
+            ["cook2"],
+        )
+
+    def test_recipe_change_form(self):
+        self.create_rows(1)
+        recipe = Dish.objects.get()
+        response = self.client.get(
+            reverse("admin:recipes_dish_change", args=(recipe.pk,))
+        )
+        self.assertContains(
+            response,
+            f'<option value="{self.ingredients[0].pk}" selected>'
+            f"{self.ingredients[0]}</option>",
+            html=True,
+        )
+        self.assertQueriesConstant(
+            reverse("admin:recipes_dish_change", args=(recipe.pk,)),
+            lambda: ComponentRecipe.objects.bulk_create(
+                ComponentRecipe(recipe=recipe, ingredient=ingredient, amount=5)
+                for ingredient in self.ingredients[3:]
+            ),
+        )
+
+
+class CountersTest(TestCase):
+    # The counters follow rows added or removed anywhere, not only through
+    # the API views.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader = map(create_user, ("author", "reader"))
+
+    def create_recipe(self):
+        return Dish.objects.create(
+            author=self.author,
+            name="Борщ",
+            text="Свёкла, капуста",
+            cooking_time=30,
+            image="recipes/images/borsch.jpg",
+        )
+
+    def assertCounters(self, recipes_count, favorites_count=None, recipe=None):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, recipes_count)
+        if recipe is not None:
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.favorites_count, favorites_count)
+
+    def test_recipes_count(self):
+        first, second = self.create_recipe(), self.create_recipe()
+        self.assertCounters(2)
+        first.delete()
+        self.assertCounters(1)
+        Dish.objects.filter(pk=second.pk).delete()
+        self.assertCounters(0)
+
+    def test_favorites_count(self):
+        recipe = self.create_recipe()
+        favorite = FavoriteDish.objects.create(user=self.reader, recipe=recipe)
+        FavoriteDish.objects.create(user=self.author, recipe=recipe)
+        self.assertCounters(1, 2, recipe)
+        favorite.delete()
+        self.assertCounters(1, 1, recipe)
+
+    def test_deleted_user_favorites(self):
+        recipe = self.create_recipe()
+        FavoriteDish.objects.create(user=self.reader, recipe=recipe)
+        self.reader.delete()
+        self.assertCounters(1, 0, recipe)
+
+    def test_full_save_keeps_counters(self):
+        recipe = self.create_recipe()
+        stale = Dish.objects.get(pk=recipe.pk)
+        FavoriteDish.objects.create(user=self.reader, recipe=recipe)
+        stale.name = "Щи"
+        stale.save()
+        self.assertCounters(1, 1, recipe)
+
+    def test_api(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        recipe = self.create_recipe()
+        url = f"/api/recipes/{recipe.pk}/favorite/"
+        self.assertEqual(client.post(url).status_code, 201)
+        self.assertCounters(1, 1, recipe)
+        self.assertEqual(client.delete(url).status_code, 204)
+        self.assertCounters(1, 0, recipe)
+        client.force_authenticate(self.author)
+        response = client.delete(f"/api/recipes/{recipe.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertCounters(0)
+
+
+@override_settings(FEED_FANOUT_LIMIT=3, FEED_PUSH_LIMIT=1)
+class FeedTimelineTest(BackgroundJobsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, *cls.followers = (
+            create_user(f"user{number}") for number in range(6)
+        )
+
+    def setUp(self):
+        self.submit = self.run_jobs_inline(FeedWorkerPool)
+        self.skip_jobs(ImageWorkerPool)
+        self.recipes = [self.publish() for _ in range(2)]
+
+    def publish(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Dish.objects.create(
+                author=self.author,
+                name="Борщ",
+                text="Свёкла, капуста",
+                cooking_time=30,
+                image="recipes/images/borsch.jpg",
+            )
+
+    def follow(self, *users):
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in users:
+                SubscriptionPlan.objects.create(user=user, author=self.author)
+
+    def unfollow(self, *users):
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in users:
+                SubscriptionPlan.objects.get(
+                    user=user, author=self.author
+                ).delete()
+
+    def assertFeeds(self, users, pulled, entries):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.feed_pulled, pulled)
+        self.assertEqual(
+            FeedEntry.objects.filter(author=self.author).count(), entries
+        )
+        expected = [recipe.pk for recipe in reversed(self.recipes)]
+        for user in users:
+            feed = FeedTimeline.fetch(
+                user, Dish.objects.all(), None, 10, False
+            )
+            self.assertEqual([recipe.pk for recipe in feed], expected)
+
+    def test_pushed_below_limit(self):
+        self.follow(*self.followers[:3])
+        self.recipes.append(self.publish())
+        self.assertFeeds(self.followers[:3], pulled=False, entries=9)
+        self.submit.assert_not_called()
+
+    def test_pulled_past_limit(self):
+        self.follow(*self.followers[:4])
+        self.recipes.append(self.publish())
+        self.assertFeeds(self.followers[:4], pulled=True, entries=0)
+
+    def test_hysteresis(self):
+        self.follow(*self.followers[:4])
+        self.unfollow(self.followers[0])
+        self.follow(self.followers[0])
+        self.unfollow(*self.followers[:2])
+        self.assertFeeds(self.followers[2:4], pulled=True, entries=0)
+        self.unfollow(self.followers[2])
+        self.assertFeeds(self.followers[3:4], pulled=False, entries=2)
+        self.follow(self.followers[4])
+        self.assertFeeds(self.followers[3:5], pulled=False, entries=4)
+
+    def test_rejected_jobs_are_settled_by_rebuild(self):
+        self.submit.side_effect = lambda task, *args: False
+        self.follow(*self.followers[:4])
+        self.unfollow(*self.followers[:2])
+        self.assertFeeds(self.followers[2:4], pulled=True, entries=2)
+        FeedTimeline.rebuild()
+        self.assertFeeds(self.followers[2:4], pulled=True, entries=0)
+        self.unfollow(self.followers[2])
+        FeedTimeline.rebuild()
+        self.assertFeeds(self.followers[3:4], pulled=False, entries=2)
+
+
+class ShortCodeTest(TestCase):
+    def test_bijection(self):
+        # A space of 3 ** 3 codes can be walked through in full.
+        with self.settings(
+            CHARACTERS_SHORT_URL="abc",
+            SHORT_CODE_LENGTH=3,
+            SHORT_CODE_MULTIPLIER=5,
+            SHORT_CODE_OFFSET=7,
+        ):
+            codes = [encode_recipe_id(pk) for pk in range(1, 27)]
+            self.assertEqual(len(set(codes)), 26)
+            self.assertEqual(
+                [decode_short_code(code) for code in codes],
+                list(range(1, 27)),
+            )
+            # The one code left over belongs to id 0 and resolves to nothing.
+            (spare,) = {
+                a + b + c for a in "abc" for b in "abc" for c in "abc"
+            } - set(codes)
+            self.assertIsNone(decode_short_code(spare))
+            with self.assertRaises(ValueError):
+                encode_recipe_id(27)
+
+    def test_round_trip(self):
+        for pk in (1, 2, 3, 1000, 10**9):
+            code = encode_recipe_id(pk)
+            self.assertEqual(len(code), settings.SHORT_CODE_LENGTH)
+            self.assertEqual(decode_short_code(code), pk)
+        self.assertNotEqual(encode_recipe_id(1)[:-1], encode_recipe_id(2)[:-1])
+
+    def test_invalid_codes(self):
+        code = encode_recipe_id(1)
+        self.assertIsNone(decode_short_code(code[:-1]))
+        self.assertIsNone(decode_short_code(code + "A"))
+        self.assertIsNone(decode_short_code("l" + code[1:]))
+        with self.assertRaises(ValueError):
+            encode_recipe_id(0)
+
+
+class RecipeIngredientIndexTest(BackgroundJobsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user("author")
+        cls.beet, cls.cabbage, cls.salt = IngredientModel.objects.bulk_create(
+            IngredientModel(name=name, measurement_unit="г")
+            for name in ("Свёкла", "Капуста", "Соль")
+        )
+        cls.recipes = []
+        for ingredients in (
+            (cls.beet, cls.cabbage),
+            (cls.beet,),
+            (cls.beet, cls.cabbage, cls.salt),
+            (cls.salt,),
+        ):
+            recipe = Dish.objects.create(
+                author=author,
+                name="Борщ",
+                text="Свёкла, капуста",
+                cooking_time=30,
+                image="recipes/images/borsch.jpg",
+            )
+            ComponentRecipe.objects.bulk_create(
+                ComponentRecipe(recipe=recipe, ingredient=ingredient, amount=5)
+                for ingredient in ingredients
+            )
+            cls.recipes.append(recipe.pk)
+
+    def setUp(self):
+        self.skip_jobs(ImageWorkerPool)
+        RecipeIngredientIndex.invalidate()
+        self.addCleanup(RecipeIngredientIndex.invalidate)
+
+    def match(self, mode, *ingredients):
+        return RecipeIngredientIndex.match(
+            {ingredient.pk for ingredient in ingredients}, mode
+        )
+
+    def assertMatches(self, mode, ingredients, expected):
+        self.assertEqual(
+            self.match(mode, *ingredients),
+            [self.recipes[number] for number in expected],
+        )
+
+    def test_match_modes(self):
+        wanted = (self.beet, self.cabbage)
+        self.assertMatches(RecipeIngredientIndex.ALL, wanted, (0, 2))
+        self.assertMatches(RecipeIngredientIndex.ANY, wanted, (0, 1, 2))
+        self.assertMatches(RecipeIngredientIndex.SUBSET, wanted, (0, 1))
+        self.assertMatches(RecipeIngredientIndex.SUBSET, [self.salt], (3,))
+        self.assertEqual(RecipeIngredientIndex.match({0}), [])
+        self.assertEqual(
+            RecipeIngredientIndex.match(
+                {0, self.salt.pk}, RecipeIngredientIndex.ANY
+            ),
+            [self.recipes[2], self.recipes[3]],
+        )
+
+    def test_updates_match_rebuild(self):
+        modes = [mode for mode, _ in RecipeIngredientIndex.MATCH_CHOICES]
+        wanted = (self.beet, self.cabbage, self.salt)
+        self.match(RecipeIngredientIndex.ALL, self.beet)
+        with self.captureOnCommitCallbacks(execute=True):
+            ComponentRecipe.objects.create(
+                recipe_id=self.recipes[1], ingredient=self.salt, amount=5
+            )
+            ComponentRecipe.objects.get(
+                recipe_id=self.recipes[3], ingredient=self.salt
+            ).delete()
+        updated = [self.match(mode, *wanted[:2]) for mode in modes]
+        updated += [self.match(mode, wanted[2]) for mode in modes]
+        RecipeIngredientIndex.rebuild()
+        rebuilt = [self.match(mode, *wanted[:2]) for mode in modes]
+        rebuilt += [self.match(mode, wanted[2]) for mode in modes]
+        self.assertEqual(updated, rebuilt)
+        self.assertMatches(RecipeIngredientIndex.ANY, [self.salt], (1, 2))
+
+    def test_api(self):
+        response = self.client.get(
+            "/api/recipes/",
+            {
+                "ingredients": f"{self.beet.pk},{self.cabbage.pk}",
+                "match": RecipeIngredientIndex.SUBSET,
+            },
+        )
+        self.assertEqual(
+            sorted(recipe["id"] for recipe in response.json()["results"]),
+            self.recipes[:2],
+        )
+        response = self.client.get(
+            "/api/recipes/", {"ingredients": self.beet.pk, "match": "none"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class MediaReferencesTest(BackgroundJobsMixin, TestCase):
+    # Files shared by rows are removed only once nothing references them
+    # and both the count and the file are older than MEDIA_GC_GRACE.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user("author")
+
+    def setUp(self):
+        self.use_temporary_media()
+        self.skip_jobs(ImageWorkerPool)
+        self.stale = timezone.now() - timedelta(
+            seconds=settings.MEDIA_GC_GRACE + 60
+        )
+
+    def store(self, content):
+        return default_storage.save(
+            "recipes/images/photo.jpg", ContentFile(content)
+        )
+
+    def age(self, name):
+        MediaFile.objects.filter(name=name).update(updated_at=self.stale)
+        moment = self.stale.timestamp()
+        os.utime(default_storage.path(name), (moment, moment))
+
+    def create_recipe(self, image, **extra):
+        return Dish.objects.create(
+            author=self.author,
+            name="Борщ",
+            text="Свёкла, капуста",
+            cooking_time=30,
+            image=image,
+            **extra,
+        )
+
+    def assertReferences(self, **references):
+        self.assertEqual(
+            dict(MediaFile.objects.values_list("name", "references")),
+            {getattr(self, name): count for name, count in references.items()},
+        )
+
+    def test_references(self):
+        self.first, self.second = self.store(b"first"), self.store(b"second")
+        self.assertEqual(self.store(b"first"), self.first)
+        recipe = self.create_recipe(self.first)
+        copy = self.create_recipe(
+            self.first, image_variants={"thumb": self.second}
+        )
+        self.assertReferences(first=2, second=1)
+        recipe.image = self.second
+        recipe.save()
+        self.assertReferences(first=1, second=2)
+        self.author.avatar = self.first
+        self.author.save()
+        copy.delete()
+        self.assertReferences(first=1, second=1)
+        recipe.name = "Щи"
+        recipe.save(update_fields=("name",))
+        self.assertReferences(first=1, second=1)
+        self.author.delete()
+        self.assertReferences(first=0, second=0)
+        self.assertEqual(MediaReferences.count(), {})
+
+    def test_grace_period(self):
+        recent, unused, reused = map(self.store, (b"1", b"2", b"3"))
+        for name in (recent, unused, reused):
+            self.create_recipe(name).delete()
+        self.age(unused)
+        self.age(reused)
+        # Saving the same bytes again starts a new grace period.
+        self.store(b"3")
+        self.assertEqual(MediaReferences.collect(dry_run=True), 1)
+        self.assertTrue(default_storage.exists(unused))
+        self.assertEqual(MediaReferences.collect(), 1)
+        self.assertFalse(default_storage.exists(unused))
+        self.assertTrue(default_storage.exists(recent))
+        self.assertTrue(default_storage.exists(reused))
+        self.assertFalse(MediaFile.objects.filter(name=unused).exists())
+
+    def test_referenced_again(self):
+        name = self.store(b"photo")
+        self.create_recipe(name).delete()
+        self.age(name)
+        self.create_recipe(name)
+        self.age(name)
+        self.assertEqual(MediaReferences.collect(full=True), 0)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_full_collection(self):
+        referenced, uncounted, fresh = map(self.store, (b"1", b"2", b"3"))
+        self.create_recipe(referenced)
+        self.age(uncounted)
+        # Files the counts never saw are only found by walking the folders.
+        self.assertEqual(MediaReferences.collect(), 0)
+        self.assertTrue(default_storage.exists(uncounted))
+        # A count that drifted to zero is repaired, not trusted.
+        MediaFile.objects.filter(name=referenced).update(references=0)
+        self.age(referenced)
+        self.assertEqual(MediaReferences.collect(full=True), 1)
+        self.assertFalse(default_storage.exists(uncounted))
+        self.assertTrue(default_storage.exists(fresh))
+        self.assertEqual(MediaFile.objects.get(name=referenced).references, 1)
+
+    def test_command(self):
+        name = self.store(b"photo")
+        self.age(name)
+        output = StringIO()
+        call_command("collect_media", "--full", "--dry-run", stdout=output)
+        self.assertIn("К удалению файлов: 1", output.getvalue())
+        self.assertTrue(default_storage.exists(name))
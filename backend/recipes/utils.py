@@ -20,3 +20,40 @@ def generate_short_token(model_class):
     raise ValueError(
         f"Не удалось сгенерировать пользовательский токен после {max_attempts} попыток"
     )
+
+
+def _short_code_space():
+    return len(settings.CHARACTERS_SHORT_URL) ** settings.SHORT_CODE_LENGTH
+
+
+def encode_recipe_id(recipe_id):
+    # An affine permutation of the code space keeps neighbouring ids from
+    # getting neighbouring codes; the mapping stays a bijection, so codes
+    # never collide and need no lookup.
+    alphabet = settings.CHARACTERS_SHORT_URL
+    space = _short_code_space()
+    if not 0 < recipe_id < space:
+        raise ValueError(
+            f"Идентификатор {recipe_id} вне диапазона коротких ссылок"
+        )
+    number = (
+        recipe_id * settings.SHORT_CODE_MULTIPLIER + settings.SHORT_CODE_OFFSET
+    ) % space
+    token = []
+    for _ in range(settings.SHORT_CODE_LENGTH):
+        number, digit = divmod(number, len(alphabet))
+        token.append(alphabet[digit])
+    return "".join(reversed(token))
+
+
+def decode_short_code(token):
+    alphabet = settings.CHARACTERS_SHORT_URL
+    if len(token) != settings.SHORT_CODE_LENGTH or set(token) - set(alphabet):
+        return None
+    space = _short_code_space()
+    number = 0
+    for char in token:
+        number = number * len(alphabet) + alphabet.index(char)
+    inverse = pow(settings.SHORT_CODE_MULTIPLIER, -1, space)
+    recipe_id = (number - settings.SHORT_CODE_OFFSET) * inverse % space
+    return recipe_id or None
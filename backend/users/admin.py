@@ -1,12 +1,24 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from core.pagination import CountingPaginator
 from .models import BlogerUser, SubscriptionPlan
 
 
 @admin.register(BlogerUser)
 class CustomUserAdmin(UserAdmin):
-    search_fields = ("username", "email")
-    search_help_text = "Поиск по юзернейму или емейлу"
+    list_display = (
+        "username",
+        "email",
+        "first_name",
+        "last_name",
+        "is_staff",
+        "recipes_count",
+        "followers_count",
+    )
+    search_fields = ("^username", "^email")
+    search_help_text = "Поиск по началу юзернейма или емейла"
+    paginator = CountingPaginator
+    show_full_result_count = False
 
 
 @admin.register(SubscriptionPlan)
@@ -15,4 +27,8 @@ class SubscriptionAdmin(admin.ModelAdmin):
         "user",
         "author",
     )
-    search_fields = ("user__username", "author__username")
+    list_select_related = ("user", "author")
+    autocomplete_fields = ("user", "author")
+    search_fields = ("^user__username", "^author__username")
+    paginator = CountingPaginator
+    show_full_result_count = False
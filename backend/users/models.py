@@ -1,8 +1,9 @@
 from django.conf import settings
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.exceptions import ValidationError
 from django.db import models
+from core.counters import CounterFieldsMixin
 from foodgram.const import (
     max_len_email,
     max_len_firstname,
@@ -11,7 +12,39 @@ from foodgram.const import (
 )
 
 
-class BlogerUser(AbstractUser):
+class BlogerUserQuerySet(models.QuerySet):
+    def with_is_subscribed(self, user):
+        if user is None or user.is_anonymous:
+            return self.annotate(
+                is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
+        return self.annotate(
+            is_subscribed=models.Exists(
+                SubscriptionPlan.objects.filter(
+                    user=user, author=models.OuterRef("pk")
+                )
+            )
+        )
+
+    def with_recipes(self, limit=None):
+        from recipes.models import Dish
+
+        return self.prefetch_related(
+            models.Prefetch(
+                "recipes",
+                queryset=Dish.objects.published()[:limit],
+                to_attr="recipes_preview",
+            )
+        )
+
+
+class BlogerUserManager(UserManager.from_queryset(BlogerUserQuerySet)):
+    pass
+
+
+class BlogerUser(CounterFieldsMixin, AbstractUser):
     username_validator = UnicodeUsernameValidator()
     email = models.EmailField(
         verbose_name="email",
@@ -40,6 +73,24 @@ class BlogerUser(AbstractUser):
         blank=True,
         default=None,
     )
+    avatar_variants = models.JSONField(
+        verbose_name="Варианты аватара",
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="Рецептов", default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name="Подписчиков", default=0, editable=False
+    )
+    feed_pulled = models.BooleanField(
+        verbose_name="Лента по запросу", default=False, editable=False
+    )
+
+    objects = BlogerUserManager()
+    counter_fields = ("recipes_count", "followers_count", "feed_pulled")
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "first_name", "last_name"]
@@ -47,6 +98,11 @@ class BlogerUser(AbstractUser):
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        indexes = (
+            models.Index(
+                fields=("-date_joined", "-id"), name="user_joined_id_idx"
+            ),
+        )
 
     def __str__(self):
         return self.username
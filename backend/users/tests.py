@@ -0,0 +1,102 @@
+import base64
+from io import BytesIO
+
+from django.test import TestCase
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.jobs import ImageWorkerPool
+from core.testing import AdminQueriesMixin, BackgroundJobsMixin, create_user
+from .models import BlogerUser, SubscriptionPlan
+
+
+class AdminQueriesTest(AdminQueriesMixin, TestCase):
+    def create_rows(self, count):
+        for _ in range(count):
+            self.created += 1
+            user = create_user(f"user{self.created}")
+            SubscriptionPlan.objects.create(user=user, author=self.admin)
+
+    def test_user_changelist(self):
+        self.assertChangelistScales(BlogerUser)
+
+    def test_user_search(self):
+        self.assertChangelistScales(BlogerUser, "?q=user")
+
+    def test_subscription_changelist(self):
+        self.assertChangelistScales(SubscriptionPlan)
+
+    def test_subscription_search(self):
+        self.assertChangelistScales(SubscriptionPlan, "?q=user")
+
+
+class AvatarVariantsTest(BackgroundJobsMixin, TestCase):
+    # Variants are rendered in ImageWorkerPool, and only for a new photo.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = BlogerUser.objects.create_user(
+            email="alice@example.com",
+            username="alice",
+            first_name="Алиса",
+            last_name="Иванова",
+            password="secret-password",
+        )
+        # A photo from before the variants, its file is long gone.
+        BlogerUser.objects.filter(pk=cls.user.pk).update(
+            avatar="users/images/alice.png"
+        )
+
+    def setUp(self):
+        self.use_temporary_media()
+        self.submit = self.run_jobs_inline(ImageWorkerPool)
+
+    def test_login_skips_unchanged_photo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(
+                "/api/auth/token/login/",
+                {"email": "alice@example.com", "password": "secret-password"},
+            )
+        self.assertEqual(response.status_code, 200)
+        user = BlogerUser.objects.get(pk=self.user.pk)
+        user.first_name = "Алиса Петровна"
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.submit.assert_not_called()
+
+    def test_new_photo(self):
+        output = BytesIO()
+        Image.new("RGB", (40, 30), "red").save(output, "PNG")
+        data = base64.b64encode(output.getvalue()).decode()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.put(
+                "/api/users/me/avatar/",
+                {"avatar": f"data:image/png;base64,{data}"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.submit.assert_called_once()
+        self.user.refresh_from_db()
+        self.assertEqual(
+            set(self.user.avatar_variants), {"original", "thumb", "webp"}
+        )
+        self.assertEqual(
+            self.user.avatar.name, self.user.avatar_variants["original"]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.delete("/api/users/me/avatar/")
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_variants, {})
+
+    def test_missing_file_is_logged(self):
+        self.user.avatar = "users/images/missing.png"
+        with self.assertLogs("core.images", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.save(update_fields=("avatar",))
+        self.submit.assert_called_once()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar.name, "users/images/missing.png")
+        self.assertEqual(self.user.avatar_variants, {})